@@ -2,14 +2,14 @@ from datetime import datetime
 from dateutil.relativedelta import relativedelta
 import os
 import json
-import requests
+import orjson
 import asyncio
-from typing import Dict, Any
-from datetime import datetime
+from typing import Dict, Any, Optional
+from datetime import datetime, date
 
 # Azure 服务SDK
-from azure.storage.blob.aio import BlobServiceClient
-from azure.cosmos.aio import CosmosClient
+from azure.cosmos.exceptions import CosmosResourceNotFoundError
+from azure_clients import get_blob_service_client, get_cosmos_client, get_http_client, get_openai_client
 
 # Semantic Kernel
 import semantic_kernel as sk
@@ -22,9 +22,8 @@ class CosmosDBClient:
     """封装与Cosmos DB的交互（使用Connection String连接）"""
     
     def __init__(self):
-        self.client = CosmosClient.from_connection_string(
-            "AccountEndpoint=h=;"
-        )
+        # 共享的 CosmosClient，不在每次查询后关闭
+        self.client = get_cosmos_client(os.getenv("COSMOS_CONNECTION_STRING"))
     
     async def get_user_info(self, applicantId: str) -> Dict[str, Any]:
         """根据user_id获取用户信息"""
@@ -32,30 +31,14 @@ class CosmosDBClient:
             database = self.client.get_database_client("cosmicworks")
             container = database.get_container_client("userinfo")
             
-            # 使用参数化查询（更安全）
-            query = "SELECT * FROM c WHERE c.id = @applicantId"
-            parameters = [
-                {"name": "@applicantId", "value": applicantId}
-            ]
-            
-            items = [
-                item 
-                async for item in container.query_items(
-                    query=query,
-                    parameters=parameters
-                    # 不再需要 enable_cross_partition_query
-                )
-            ]
-            
-            if not items:
+            # 按 id 直接点读（分区键为 id），不经过查询引擎
+            try:
+                return await container.read_item(item=applicantId, partition_key=applicantId)
+            except CosmosResourceNotFoundError:
                 raise ValueError(f"未找到用户ID: {applicantId}")
-            
-            return items[0]
         except Exception as e:
             print(f"[Cosmos DB] 查询失败: {str(e)}")
             raise
-        finally:
-            await self.client.close()
 
 
 # --- Azure Blob 存储操作 ---
@@ -63,10 +46,8 @@ class ContractProofLoader:
     """从Blob Storage加载收入证明"""
     
     def __init__(self):
-        self.client = BlobServiceClient(
-            account_url="",
-            credential=""
-        )
+        # 共享连接池的 BlobServiceClient，连接在多次下载间复用
+        self.client = get_blob_service_client(os.getenv("AZURE_STORAGE_CONNECTION_STRING"))
     async def load_contract_data(self, blob_path: str) -> Dict[str, Any]:
         """异步加载JSON格式的收入证明"""
         try:
@@ -88,13 +69,19 @@ class ComplianceReview:
     
     def __init__(self):
         self.kernel = sk.Kernel()
+        # 连接信息从环境变量（或 Key Vault）读取，不写在代码中
+        endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
+        api_key = os.getenv("AZURE_OPENAI_API_KEY")
+        api_version = os.getenv("AZURE_OPENAI_API_VERSION", "2024-12-01-preview")
         self.kernel.add_service(
             AzureChatCompletion(
                 service_id="credit_ai",
-                deployment_name="gpt-4o-mini",
-                endpoint="",
-                api_key="",
-                api_version="2024-12-01-preview"
+                deployment_name=os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4o-mini"),
+                endpoint=endpoint,
+                api_key=api_key,
+                api_version=api_version,
+                # 复用长连接，减少每次调用的建连开销
+                async_client=get_openai_client(endpoint, api_key, api_version)
             )
         )
         
@@ -147,11 +134,21 @@ class ComplianceReview:
                 "timestamp": datetime.now().isoformat()
             }
 
+# 共享的合规审查实例（Kernel 与提示词函数只创建一次）
+_compliance_review: Optional[ComplianceReview] = None
+
+def get_compliance_review() -> ComplianceReview:
+    """获取共享的 ComplianceReview 实例"""
+    global _compliance_review
+    if _compliance_review is None:
+        _compliance_review = ComplianceReview()
+    return _compliance_review
+
 async def compliance_review_workflow(user_id: str) -> Dict[str, Any]:
     # 初始化各客户端
     cosmos_client = CosmosDBClient()
     blob_loader = ContractProofLoader()
-    evaluator = ComplianceReview()
+    evaluator = get_compliance_review()
 
     try:
         # Step 1: 获取用户信息
@@ -162,18 +159,16 @@ async def compliance_review_workflow(user_id: str) -> Dict[str, Any]:
         contract_number = "CN-20250408-004"
         loan_amount = str(user_info.get("loanAmount"))
         loan_term_years = str(user_info.get("loanTerm"))
-        lst = user_info.get("loanTerm")
-        loan_start_date_first = datetime.fromisoformat(user_info.get("loanStartDate")).date().strftime("%Y-%m-%d")#(user_info.get("loanStartDate")).date()
-        loan_start_date = str(loan_start_date_first)
-        loan_end_date_first = datetime.fromisoformat(user_info.get("loanStartDate")).date() + relativedelta(years=25)
-        loan_end_date = str(loan_end_date_first.strftime("%Y-%m-%d"))
+        loan_start = date.fromisoformat(user_info.get("loanStartDate")[:10])
+        loan_start_date = loan_start.isoformat()
+        loan_end_date = (loan_start + relativedelta(years=25)).isoformat()
         loan_interest_rate = "2.35%"
         repayment_method = "Fixed Payment Mortgage"
         repayment_due_date = "3rd day of each month"
         property_address = "Room 1803, Building 5, NAGA Shangyuan (或 NAGA Upper Court), No. 9 Dongzhimennei Street, Dongcheng District, Beijing, China"
         property_area = str(user_info.get("propertyArea")) 
         property_price = int(user_info.get("propertyPrice"))
-        ltv_ratio = str("{:.2%}".format(user_info.get("loanAmount")/property_price)) #总房款暂时设置成两百万，等有了前端传入的数据再修改
+        ltv_ratio = f"{user_info.get('loanAmount') / property_price:.2%}" #总房款暂时设置成两百万，等有了前端传入的数据再修改
 
         contractData = {
             "borrower_name": borrower_name,
@@ -191,12 +186,10 @@ async def compliance_review_workflow(user_id: str) -> Dict[str, Any]:
             "ltv_ratio": ltv_ratio
         }
 
-        contractData_json = json.dumps(contractData, ensure_ascii=False, indent=2)
-        
         web_app_url = "https://pdfcontract-d6hef0cgg0dughhq.eastus2-01.azurewebsites.net/generate_mortgage_contract"
-        # 调用 POST 方法
-        response = requests.post(web_app_url, json=contractData)
-        contract_file_path = response.json()["filename"]
+        # 调用 POST 方法（异步请求，不阻塞事件循环）
+        response = await get_http_client().post(web_app_url, json=contractData)
+        contract_file_path = orjson.loads(response.content)["filename"]
         print("Contract documents generated:" + contract_file_path)
         contract = await blob_loader.load_contract_data(contract_file_path)
         loanPolicy = await blob_loader.load_contract_data("Bank Internal Personal Housing Loan Policy.pdf")
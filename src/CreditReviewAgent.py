@@ -5,24 +5,24 @@ Azure AI 信用评分系统
 2. 从Azure Blob Storage加载收入证明JSON
 3. 使用Azure OpenAI分析信用风险
 4. 计算FICO信用评分（300-850）
+AutoGen 集成层位于 CreditReviewAutoGen.py，Azure Function 入口不会导入 autogen。
 环境要求：
 pip install semantic-kernel>=1.0.0 azure-ai-foundry azure-storage-blob python-dotenv
 """
 
 import os
 import json
+import orjson
 import asyncio
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from datetime import datetime
 from dotenv import load_dotenv
 import azure.functions as func
 
 # Azure 服务SDK
-from azure.identity import DefaultAzureCredential
-from azure.storage.blob.aio import BlobServiceClient
+from azure_clients import get_blob_service_client, get_project_client, get_foundry_agent, get_openai_client
 
 from azure.ai.projects.aio import AIProjectClient
-from azure.core.credentials import AzureKeyCredential
 
 # Semantic Kernel
 import semantic_kernel as sk
@@ -32,8 +32,6 @@ from semantic_kernel.prompt_template import PromptTemplateConfig, InputVariable
 from semantic_kernel.contents import ChatHistory
 from semantic_kernel.functions import KernelArguments
 
-from autogen import ConversableAgent
-
 # 加载环境变量（适用于本地开发和Azure Function配置）
 load_dotenv()
 
@@ -43,26 +41,18 @@ class FoundryIncomeAgent:
     """封装与Foundry AI的交互"""
     
     def __init__(self):
-        self.client = AIProjectClient.from_connection_string(
-            credential=DefaultAzureCredential(),
-            conn_str="",
-        )  
+        # 复用共享的 AIProjectClient 与凭据，不再每次新建连接、重新获取令牌
+        self.connection_string = os.getenv("AZURE_AI_PROJECT_CONNECTION_STRING")
+        self.client = get_project_client(self.connection_string)
         # print(self.client)
     async def get_income_blob_path(self, filename: str) -> str:
         """
         调用Foundry Agent获取收入证明的Blob路径
         """    
         try:
-            agent_definition = await self.client.agents.get_agent(agent_id="")
-            getBlobPath_agent = AzureAIAgent(client=self.client, definition=agent_definition)
+            getBlobPath_agent = await get_foundry_agent(self.connection_string, "asst_cb5vNNrQzB8BDMGms51SMt7A")
             thread: AzureAIAgentThread = None
             response = await getBlobPath_agent.get_response(messages=filename, thread=thread)
-            res = response.message.items[0].text
-            # print(f"# {response.name}: {response}")
-            # print(response.message.items[0].text)
-            # print(f"Full response: {vars(response)}")  # 查看所有属性
-            # print(f"Content type: {type(response)}")  # 确认类型
-            thread = response.thread
             
             if not response:
                 raise ValueError("Foundry Agent未返回有效的blob_path")
@@ -78,10 +68,8 @@ class IncomeProofLoader:
     """从Blob Storage加载收入证明"""
     
     def __init__(self):
-        self.client = BlobServiceClient(
-            account_url="",
-            credential=""
-        )
+        # 共享连接池的 BlobServiceClient，连接在多次下载间复用
+        self.client = get_blob_service_client(os.getenv("AZURE_STORAGE_CONNECTION_STRING"))
     
     async def load_income_data(self, blob_path: str) -> Dict[str, Any]:
         """异步加载JSON格式的收入证明"""
@@ -94,7 +82,7 @@ class IncomeProofLoader:
             downloader = await blob_client.download_blob()
             data = await downloader.readall()
             #data = await blob_client.download_blob().readall()
-            return json.loads(data.decode('utf-8'))
+            return orjson.loads(data)
             
         except Exception as e:
             print(f"[Blob Storage] 加载失败: {blob_path}, 错误: {str(e)}")
@@ -106,13 +94,19 @@ class CreditEvaluator:
     
     def __init__(self):
         self.kernel = sk.Kernel()
+        # 连接信息从环境变量（或 Key Vault）读取，不写在代码中
+        endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
+        api_key = os.getenv("AZURE_OPENAI_API_KEY")
+        api_version = os.getenv("AZURE_OPENAI_API_VERSION", "2024-12-01-preview")
         self.kernel.add_service(
             AzureChatCompletion(
                 service_id="credit_ai",
-                deployment_name="gpt-4o-mini",
-                endpoint="",
-                api_key="",
-                api_version="2024-12-01-preview"
+                deployment_name=os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4o-mini"),
+                endpoint=endpoint,
+                api_key=api_key,
+                api_version=api_version,
+                # 复用长连接，减少每次调用的建连开销
+                async_client=get_openai_client(endpoint, api_key, api_version)
             )
         )
         
@@ -163,6 +157,16 @@ class CreditEvaluator:
                 "message": str(e),
                 "timestamp": datetime.now().isoformat()
             }
+# 共享的信用评估实例（Kernel 与提示词函数只创建一次）
+_credit_evaluator: Optional[CreditEvaluator] = None
+
+def get_credit_evaluator() -> CreditEvaluator:
+    """获取共享的 CreditEvaluator 实例"""
+    global _credit_evaluator
+    if _credit_evaluator is None:
+        _credit_evaluator = CreditEvaluator()
+    return _credit_evaluator
+
 app = func.FunctionApp(http_auth_level=func.AuthLevel.FUNCTION)
 
 @app.route(route="analyze_credit", methods=["POST"])
@@ -184,7 +188,7 @@ async def analyze_credit(req: func.HttpRequest) -> func.HttpResponse:
         result = await credit_analysis_workflow(certificate_file, statements_file)
         
         return func.HttpResponse(
-            json.dumps(result, ensure_ascii=False),
+            orjson.dumps(result),
             status_code=200,
             mimetype="application/json"
         )
@@ -196,7 +200,7 @@ async def analyze_credit(req: func.HttpRequest) -> func.HttpResponse:
         )
     except Exception as e:
         return func.HttpResponse(
-            json.dumps({
+            orjson.dumps({
                 "error": str(e),
                 "timestamp": datetime.now().isoformat()
             }),
@@ -208,19 +212,23 @@ async def credit_analysis_workflow(CertificateOfEmployment: str, BankStatements:
     # 初始化各客户端
     foundry_agent = FoundryIncomeAgent()
     blob_loader = IncomeProofLoader()
-    evaluator = CreditEvaluator()
+    evaluator = get_credit_evaluator()
 
     try:
         # Step 1: 获取Blob路径
-        COE_blob_path = await foundry_agent.get_income_blob_path(CertificateOfEmployment)
+        COE_blob_path, BS_blob_path = await asyncio.gather(
+            foundry_agent.get_income_blob_path(CertificateOfEmployment),
+            foundry_agent.get_income_blob_path(BankStatements)
+        )
         print("COE_blob_path："+COE_blob_path)
-        BS_blob_path = await foundry_agent.get_income_blob_path(BankStatements)
         print("BS_blob_path："+BS_blob_path)
-        # Step 2: 加载收入证明
-        COE_data = await blob_loader.load_income_data(COE_blob_path)
-        print("The content of the certificate of employment:" + COE_data)
-        BS_data = await blob_loader.load_income_data(BS_blob_path)
-        print("The contents of the bank statement:" + BS_data)
+        # Step 2: 加载收入证明（并发下载）
+        COE_data, BS_data = await asyncio.gather(
+            blob_loader.load_income_data(COE_blob_path),
+            blob_loader.load_income_data(BS_blob_path)
+        )
+        print(f"The content of the certificate of employment: {COE_data}")
+        print(f"The contents of the bank statement: {BS_data}")
         # Step 3: 信用评估
         result = await evaluator.evaluate(COE_data,BS_data)
         print(result)
@@ -231,55 +239,3 @@ async def credit_analysis_workflow(CertificateOfEmployment: str, BankStatements:
             "message": f"工作流执行失败: {str(e)}",
             "timestamp": datetime.now().isoformat()
         }
-
-# ------------------------- AutoGen 集成层（新增部分）-------------------------
-class CreditAnalysisAgent(ConversableAgent):
-    def __init__(self, name="CreditAnalyst"):
-        llm_config = {
-            "config_list": [{
-                "model": "gpt-3.5-turbo",
-                "api_key": "sk-anything", 
-                "base_url": "http://placeholder.com"
-            }],
-            "timeout": 600
-        }
-
-        super().__init__(
-            name=name,
-            system_message="信用评分专家，可调用analyze_credit函数进行分析",
-            human_input_mode="NEVER",
-            llm_config=llm_config
-        )
-
-        # 定义函数并手动绑定到实例
-        async def analyze_credit(CertificateOfEmployment: str, BankStatements: str) -> Dict[str, Any]:
-            """执行信用评分分析（输入文件名，返回评分结果）"""
-            return await self._analyze_credit_impl(CertificateOfEmployment,BankStatements)
-        
-        # 将函数绑定到实例
-        self.analyze_credit = analyze_credit
-        
-        # 使用正确的注册方式
-        self.register_for_llm(
-            description="执行信用评分分析（输入文件名，返回评分结果）"
-        )(analyze_credit)
-        
-        self.register_for_execution()(analyze_credit)
-    
-    async def _analyze_credit_impl(self, CertificateOfEmployment: str, BankStatements: str) -> Dict[str, Any]:
-        """实际的信用分析实现"""
-        result = await credit_analysis_workflow(CertificateOfEmployment,BankStatements)
-        return {
-            "origin_result": result,
-            "auto_gen_compatible": True,
-            "timestamp": datetime.now().isoformat()
-        }
-
-# 使用示例
-async def demo():
-    credit_agent = CreditAnalysisAgent()
-    response = await credit_agent.analyze_credit("zhangsanzaizhi.png","yinhangliushui.png")  # 现在可以正确调用
-    print("Credit score results:", json.dumps(response, indent=2))
-
-if __name__ == "__main__":
-    asyncio.run(demo())
\ No newline at end of file
@@ -0,0 +1,66 @@
+"""
+信用评分 AutoGen 集成层
+把 credit_analysis_workflow 封装为 AutoGen Agent 的工具函数。
+与 CreditReviewAgent.py 分开，避免 Azure Function 冷启动时导入 autogen。
+"""
+
+import json
+import asyncio
+from typing import Dict, Any
+from datetime import datetime
+
+from autogen import ConversableAgent
+
+from CreditReviewAgent import credit_analysis_workflow
+
+# ------------------------- AutoGen 集成层（新增部分）-------------------------
+class CreditAnalysisAgent(ConversableAgent):
+    def __init__(self, name="CreditAnalyst"):
+        llm_config = {
+            "config_list": [{
+                "model": "gpt-3.5-turbo",
+                "api_key": "sk-anything", 
+                "base_url": "http://placeholder.com"
+            }],
+            "timeout": 600
+        }
+
+        super().__init__(
+            name=name,
+            system_message="信用评分专家，可调用analyze_credit函数进行分析",
+            human_input_mode="NEVER",
+            llm_config=llm_config
+        )
+
+        # 定义函数并手动绑定到实例
+        async def analyze_credit(CertificateOfEmployment: str, BankStatements: str) -> Dict[str, Any]:
+            """执行信用评分分析（输入文件名，返回评分结果）"""
+            return await self._analyze_credit_impl(CertificateOfEmployment,BankStatements)
+        
+        # 将函数绑定到实例
+        self.analyze_credit = analyze_credit
+        
+        # 使用正确的注册方式
+        self.register_for_llm(
+            description="执行信用评分分析（输入文件名，返回评分结果）"
+        )(analyze_credit)
+        
+        self.register_for_execution()(analyze_credit)
+    
+    async def _analyze_credit_impl(self, CertificateOfEmployment: str, BankStatements: str) -> Dict[str, Any]:
+        """实际的信用分析实现"""
+        result = await credit_analysis_workflow(CertificateOfEmployment,BankStatements)
+        return {
+            "origin_result": result,
+            "auto_gen_compatible": True,
+            "timestamp": datetime.now().isoformat()
+        }
+
+# 使用示例
+async def demo():
+    credit_agent = CreditAnalysisAgent()
+    response = await credit_agent.analyze_credit("zhangsanzaizhi.png","yinhangliushui.png")  # 现在可以正确调用
+    print("Credit score results:", json.dumps(response, indent=2))
+
+if __name__ == "__main__":
+    asyncio.run(demo())
\ No newline at end of file
@@ -1,27 +1,24 @@
 import os
 import json
+import orjson
 import asyncio
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 from datetime import datetime
 from dotenv import load_dotenv
 import logging
 
 # Azure 服务SDK
-from azure.identity import DefaultAzureCredential
 from azure.storage.blob.aio import BlobServiceClient
-from azure.cosmos.aio import CosmosClient
+from azure.cosmos.exceptions import CosmosResourceNotFoundError
+from azure_clients import get_cosmos_client, get_project_client, get_foundry_agent, get_openai_client
 from azure.ai.projects.aio import AIProjectClient
 from azure.core.credentials import AzureKeyCredential
 
 # Semantic Kernel
 import semantic_kernel as sk
-from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion
-from semantic_kernel.agents import ChatCompletionAgent, AgentGroupChat, AzureAIAgent
-from semantic_kernel.agents.strategies import SequentialSelectionStrategy, DefaultTerminationStrategy
+from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion, AzureChatPromptExecutionSettings
 from semantic_kernel.functions import KernelArguments, KernelFunctionFromPrompt
-from semantic_kernel.prompt_template import PromptTemplateConfig, InputVariable
-from semantic_kernel.contents import ChatHistory
-from semantic_kernel.contents.chat_message_content import ChatMessageContent
+from semantic_kernel.prompt_template import PromptTemplateConfig, InputVariable, KernelPromptTemplate
 from semantic_kernel.connectors.ai.prompt_execution_settings import PromptExecutionSettings
 
 # --- Cosmos DB 客户端 ---
@@ -30,9 +27,7 @@ class CosmosDBClient:
     """封装与Cosmos DB的交互（使用Connection String连接）"""
     
     def __init__(self):
-        self.client = CosmosClient.from_connection_string(
-            "AccountEndpoint=https://=;"
-        )
+        self.client = get_cosmos_client(os.getenv("COSMOS_CONNECTION_STRING"))
     
     async def get_user_info(self, user_id: str) -> Dict[str, Any]:
         """根据user_id获取用户信息"""
@@ -40,30 +35,14 @@ class CosmosDBClient:
             database = self.client.get_database_client("cosmicworks")
             container = database.get_container_client("userinfo")
             
-            # 使用参数化查询（更安全）
-            query = "SELECT * FROM c WHERE c.id = @user_id"
-            parameters = [
-                {"name": "@user_id", "value": user_id}
-            ]
-            
-            items = [
-                item 
-                async for item in container.query_items(
-                    query=query,
-                    parameters=parameters
-                    # 不再需要 enable_cross_partition_query
-                )
-            ]
-            
-            if not items:
+            # 按 id 直接点读（分区键为 id），不经过查询引擎
+            try:
+                return await container.read_item(item=user_id, partition_key=user_id)
+            except CosmosResourceNotFoundError:
                 raise ValueError(f"未找到用户ID: {user_id}")
-            
-            return items[0]
         except Exception as e:
             print(f"[Cosmos DB] 查询失败: {str(e)}")
             raise
-        finally:
-            await self.client.close()
 
 
 # --- Foundry 客户端 ---
@@ -71,18 +50,16 @@ class FoundryIncomeAgent:
     """封装与Foundry AI的交互"""
     
     def __init__(self):
-        self.client = AIProjectClient.from_connection_string(
-            credential=DefaultAzureCredential(),
-            conn_str="",
-        )  
+        # 复用共享的 AIProjectClient 与凭据，不再每次新建连接、重新获取令牌
+        self.connection_string = os.getenv("AZURE_AI_PROJECT_CONNECTION_STRING")
+        self.client = get_project_client(self.connection_string)
     
     async def get_EvidenceOfFraud_blob_path(self, userName: str) -> str:
         """
         调用Foundry Agent获取调用web api获取用户欺诈风险调查结果
         """    
         try:
-            agent_definition = await self.client.agents.get_agent(agent_id="")
-            getBlobPath_agent = AzureAIAgent(client=self.client, definition=agent_definition)
+            getBlobPath_agent = await get_foundry_agent(self.connection_string, "asst_zvCohHloGovi4OvDnQLTKkbd")
             response = await getBlobPath_agent.get_response(messages=userName)
             
             # 安全处理响应
@@ -98,28 +75,10 @@ class FoundryIncomeAgent:
 
 
 # --- 欺诈检测核心 ---
-class FraudEvaluator:
-    def __init__(self):
-        
-        self.kernel = sk.Kernel()
-        self.kernel.add_service(
-            AzureChatCompletion(
-                service_id="credit_ai",
-                deployment_name="gpt-4o-mini",
-                endpoint="https://hackathonfound6454649233.openai.azure.com/openai/deployments/gpt-4o-mini/chat/completions?api-version=2025-01-01-preview",
-                api_key="U",
-                api_version="2024-12-01-preview"
-            )
-        )
-        # 初始化真正的Agent实例
-        self.risk_agent = ChatCompletionAgent(
-            kernel=self.kernel,
-            name="risk_agent",
-            instructions="""
+# 风险专家与客户经理的角色说明（原群聊中两个 Agent 的 instructions）
+RISK_AGENT_INSTRUCTIONS = """
             You are an expert in anti fraud in banks and will pay special attention to the risk points of information：
-            Before each speak,  show 【Challenger Agent】.
-            Start by making your point: you claim that the transaction is illegal and that there is a risk of fraud.
-            In a sentence or two, explain the following reasons:
+            You claim that the transaction is illegal and that there is a risk of fraud, and explain in a sentence or two:
             1.Identity Consistency:Name, ID number, and phone number match official records.No discrepancies in personal information.
             2.Social Insurance Verification:Consistent payments for the last 3 months from the same employer.Employer name matches the application details .
             3.Loan repayment:No overdue payments in the last 3 months.Full repayment  and on-time status.
@@ -128,75 +87,46 @@ class FraudEvaluator:
             6.Legal & Credit History:No criminal records.Zero overdue records in credit history .
             
             Risk points must be clearly identified upon discovery.To completely eliminate the occurrence of fraud.
-            """,
-            description="anti fraud"
-        )
-        
-        self.service_agent = ChatCompletionAgent(
-            kernel=self.kernel,
-            name="service_agent",
-            instructions="""
+"""
 
-            You are the customer manager of the bank, responsible for helping users explain the rationality of materials. You will focus on the user's contributions and advantages, assist users in completing loan approval, and list the following key information of the user:
-            Before each speak, show 【Defender Agent】.
-            Start by stating your point of view: you assert the reasonableness of the transaction and that there is no fraud.
-            In a sentence or two, explain the following reasons:
+SERVICE_AGENT_INSTRUCTIONS = """
+            You are the customer manager of the bank, responsible for helping users explain the rationality of materials.
+            You assert the reasonableness of the transaction and that there is no fraud, and explain in a sentence or two:
             1. Demonstrate the reasonableness of the special circumstances
             2. Possibility of additional materials
             3. Customer Historical Contribution
-            """,
-            description="customer manager"
-        )
-        
-        
-        # 群聊设置
-        self.group_chat = AgentGroupChat(
-            agents=[self.risk_agent, self.service_agent],
-            selection_strategy=SequentialSelectionStrategy(),
-            termination_strategy=DefaultTerminationStrategy(maximum_iterations=4)
-        )
-        
-       
-    
-    async def evaluate(self, evidence_data: Dict[str, Any]) -> Dict[str, Any]:
-        try:
-            # 1. 直接将证据数据转换为字符串作为初始提示
-            evidence_str = json.dumps(evidence_data, ensure_ascii=False)
-            
-            # 2. 创建初始消息内容
-            initial_message = ChatMessageContent(
-                role="user",
-                content=f"Analyze the following evidence of fraud data:\n{evidence_str}"
-            )
-            
-            # 3. 直接添加到群聊（不需要ChatHistory）
-            await self.group_chat.add_chat_message(initial_message)
-            
-            # 4. 收集响应
-            discussion = []
-            async for msg in self.group_chat.invoke():
-                if isinstance(msg, ChatMessageContent):
-                    discussion.append(f"{msg.role}: {msg.content}")
+"""
 
+# 一次调用同时给出挑战方、辩护方意见和最终裁决，替代多轮群聊 + 总结
+FRAUD_REVIEW_TEMPLATE = KernelPromptTemplate(
+    prompt_template_config=PromptTemplateConfig(
+    template="""
+            You will review fraud evidence for a bank loan application by playing two experts and then an arbiter.
+            Challenger Agent:""" + RISK_AGENT_INSTRUCTIONS + """
+            Defender Agent:""" + SERVICE_AGENT_INSTRUCTIONS + """
+            Arbiter Agent:
+            Make a final decision based on both opinions, adopt more positive opinions, and try to approve the loan as much as possible.
+            First say whether there is a risk of fraud, then briefly explain the reason (1~2 sentences).
 
-            # 5. 生成最终决策
-            if not discussion:
-                raise ValueError("讨论记录为空，无法生成决策")
-            
-            # 1. 将讨论内容格式化为更清晰的对话记录
-            formatted_discussion = "\n".join([
-                f"{msg.split(':', 1)[1].strip()}" #【{msg.split(':')[0]}】
-                for msg in discussion
-            ])
-        
-            print("=== 完整讨论记录 ===")
-            print(formatted_discussion)
+            Output format only: a JSON object with the fields
+            "challenger": the Challenger Agent's opinion,
+            "defender": the Defender Agent's opinion,
+            "arbiter": the Arbiter Agent's conclusion and reason
+
+            Fraud evidence data:
+            {{$evidence}}
+            """,
+    template_format="semantic-kernel"
+    )
+)
 
-            # 2. 创建更明确的总结提示
-            summary_prompt = f"""
+# 结构化输出无法解析时的兜底：把原始输出当作讨论记录再总结一次
+FRAUD_SUMMARY_TEMPLATE = KernelPromptTemplate(
+    prompt_template_config=PromptTemplateConfig(
+    template="""
             Please make a final decision based on the following expert discussions, adopt more positive opinions, and try to approve the loan as much as possible:
         
-            {formatted_discussion}
+            {{$discussion}}
         
             Decision requirements:
             1. Clear conclusion: approved or rejected
@@ -204,24 +134,88 @@ class FraudEvaluator:
             3. Concise reasons (2-3 sentences)
             Before each speak, show 【Arbiter Agent】
             You first say whether there is a risk of fraud in the conclusion, and then briefly explain the reason (1~2 sentences)
-            
-            """
+            """,
+    template_format="semantic-kernel"
+    )
+)
+
+class FraudEvaluator:
+    def __init__(self):
+        self.logger = logging.getLogger("fraud_evaluator")
+        self.kernel = sk.Kernel()
+        # 连接信息从环境变量（或 Key Vault）读取，不写在代码中
+        endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
+        api_key = os.getenv("AZURE_OPENAI_API_KEY")
+        api_version = os.getenv("AZURE_OPENAI_API_VERSION", "2024-12-01-preview")
+        self.kernel.add_service(
+            AzureChatCompletion(
+                service_id="credit_ai",
+                deployment_name=os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4o-mini"),
+                endpoint=endpoint,
+                api_key=api_key,
+                api_version=api_version,
+                # 复用长连接，减少每次调用的建连开销
+                async_client=get_openai_client(endpoint, api_key, api_version)
+            )
+        )
 
-            # 3. 直接使用AzureChatCompletion进行总结
-            chat_service = self.kernel.get_service("credit_ai")
-            chat_history = ChatHistory()
-            chat_history.add_user_message(summary_prompt)
-            settings =PromptExecutionSettings(
+        # 挑战方、辩护方与仲裁在一次 JSON 输出中完成
+        self.fraud_review = self.kernel.add_function(
+            plugin_name="DecisionServices",
+            function_name="FraudReview",
+            prompt_template=FRAUD_REVIEW_TEMPLATE,
+            prompt_execution_settings=AzureChatPromptExecutionSettings(
                 service_id="credit_ai",
-                temperature=0.7, 
-                max_tokens=500
+                response_format={"type": "json_object"},
+                temperature=0.0
+            )
+        )
+
+        # 总结函数只注册一次，evaluate 中直接调用
+        self.make_final_decision = self.kernel.add_function(
+            plugin_name="DecisionServices",
+            function_name="MakeFinalDecision",
+            prompt_template=FRAUD_SUMMARY_TEMPLATE,
+            # 结论 + 1~2 句理由，限制输出长度并使用确定性输出
+            prompt_execution_settings=PromptExecutionSettings(
+                service_id="credit_ai",
+                temperature=0.0,
+                max_tokens=120
+            )
+        )
+    
+    async def evaluate(self, evidence_data: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            # 1. 直接将证据数据转换为字符串作为提示（已是字符串时不再重复序列化）
+            if isinstance(evidence_data, (dict, list)):
+                evidence_str = orjson.dumps(evidence_data, default=str).decode()
+            else:
+                evidence_str = str(evidence_data)
+            
+            # 2. 一次模型调用完成双方意见与裁决
+            result = await self.kernel.invoke(
+                self.fraud_review,
+                arguments=KernelArguments(evidence=evidence_str)
+            )
+            try:
+                review = orjson.loads(str(result))
+            except ValueError:
+                review = None
+            
+            if isinstance(review, dict):
+                self.logger.debug(
+                    "=== 完整讨论记录 ===\n【Challenger Agent】%s\n【Defender Agent】%s",
+                    review.get('challenger', ''),
+                    review.get('defender', '')
                 )
-            # 4. 调用并严格验证结果
-            result = await chat_service.get_chat_message_contents(
-                chat_history=chat_history,
-                kernel=self.kernel,
-                settings=settings)
-            decision_content = str(result[0].content)
+                return f"【Arbiter Agent】{review.get('arbiter', '')}"
+            
+            # 3. 输出不是有效的 JSON 时，调用预先注册的总结函数
+            result = await self.kernel.invoke(
+                self.make_final_decision,
+                arguments=KernelArguments(discussion=str(result))
+            )
+            decision_content = str(result)
 
             return decision_content
 
@@ -233,12 +227,22 @@ class FraudEvaluator:
                 "timestamp": datetime.now().isoformat()
             }
 
+# 共享的欺诈评估实例（Kernel、Agent 与群聊只创建一次）
+_fraud_evaluator: Optional[FraudEvaluator] = None
+
+def get_fraud_evaluator() -> FraudEvaluator:
+    """获取共享的 FraudEvaluator 实例"""
+    global _fraud_evaluator
+    if _fraud_evaluator is None:
+        _fraud_evaluator = FraudEvaluator()
+    return _fraud_evaluator
+
 async def fraud_analysis_workflow(user_id: str) -> Dict[str, Any]:
     """欺诈分析工作流"""
     try:
         # 初始化客户端
         foundry_agent = FoundryIncomeAgent()
-        evaluator = FraudEvaluator()
+        evaluator = get_fraud_evaluator()
         cosmos_client = CosmosDBClient()
         
 
@@ -247,15 +251,15 @@ async def fraud_analysis_workflow(user_id: str) -> Dict[str, Any]:
         user_name = user_info.get("name")
         if not user_name:
             raise ValueError("用户信息中缺少姓名")
-        print(f"get user info: {json.dumps(user_info, indent=2)}")
+        print(f"get user info: {orjson.dumps(user_info, option=orjson.OPT_INDENT_2, default=str).decode()}")
         user_name_str = "tell me about fraud assessment information:" + user_name
         print(user_name_str)
         investigation_result = await foundry_agent.get_EvidenceOfFraud_blob_path(user_name_str)
-        investigation = {json.dumps(investigation_result, ensure_ascii=False, indent=2)}
-        print(f"Obtain anti-fraud data collection information: {json.dumps(investigation_result, ensure_ascii=False, indent=2)}")
+        investigation = investigation_result
+        print(f"Obtain anti-fraud data collection information: {orjson.dumps(investigation_result, option=orjson.OPT_INDENT_2, default=str).decode()}")
 
         # 评估欺诈风险
-        result = await evaluator.evaluate(str(investigation))
+        result = await evaluator.evaluate(investigation)
         return result
         
         # 加载数据
@@ -0,0 +1,397 @@
+"""
+共享的 Azure 客户端
+各工作流复用同一个 CosmosClient / BlobServiceClient / AIProjectClient / Azure OpenAI / HTTP 客户端和 Azure 凭据，
+避免每次调用重新建立 TCP/TLS 连接或重新获取 AAD 令牌。
+客户端在首次使用时（事件循环内）创建，进程退出前调用 close_clients() 统一关闭。
+未配置连接字符串 / API Key 时改用托管标识（DefaultAzureCredential）认证；
+配置了 AZURE_KEY_VAULT_URL 时，启动阶段调用 load_secrets() 从 Key Vault 读取一次密钥。
+"""
+
+import os
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+import aiohttp
+import httpx
+from aiolimiter import AsyncLimiter
+from azure.ai.projects.aio import AIProjectClient
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.identity import DefaultAzureCredential
+from azure.identity.aio import DefaultAzureCredential as AsyncDefaultAzureCredential
+from azure.identity.aio import get_bearer_token_provider
+from azure.keyvault.secrets.aio import SecretClient
+from azure.storage.blob.aio import BlobServiceClient
+from azure.cosmos.aio import CosmosClient
+from openai import AsyncAzureOpenAI
+from semantic_kernel.agents import AzureAIAgent
+
+logger = logging.getLogger("azure_clients")
+
+# 连接池总连接数 / 单个主机的连接数
+POOL_SIZE = 200
+POOL_SIZE_PER_HOST = 100
+# aiohttp 空闲连接保持时间与 DNS 缓存时间（秒）
+AIOHTTP_KEEPALIVE_TIMEOUT = 120
+DNS_CACHE_TTL = 300
+# 连接 / 读取超时（秒）
+CONNECTION_TIMEOUT = 10
+READ_TIMEOUT = 60
+# 空闲长连接保持时间（秒）
+KEEPALIVE_EXPIRY = 60
+# Cosmos 读取使用会话一致性（账户默认更强时可降低读取开销）
+COSMOS_CONSISTENCY_LEVEL = "Session"
+# Azure OpenAI 保持的空闲长连接数
+OPENAI_KEEPALIVE_CONNECTIONS = 32
+# 瞬时错误（408/429/5xx、连接中断）的重试：SDK 管道内指数退避，失败的请求单独重试而不是重跑整个工作流
+RETRY_SETTINGS = {
+    "retry_total": 3,
+    "retry_backoff_factor": 0.2,
+    "retry_backoff_max": 4
+}
+OPENAI_MAX_RETRIES = 3
+# 同时进行的模型调用上限（按部署的 RPM/TPM 配额设置），超出的调用排队等待而不是撞上 429
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+# 每分钟模型请求数上限（按部署的 RPM 配额设置），0 表示不限速
+LLM_RPM = int(os.getenv("LLM_RPM", "0"))
+# 凭据链中不使用的来源（生产用托管标识，本地开发用环境变量或 Azure CLI），跳过以免逐个探测
+CREDENTIAL_EXCLUDES = {
+    "exclude_interactive_browser_credential": True,
+    "exclude_visual_studio_code_credential": True,
+    "exclude_shared_token_cache_credential": True,
+    "exclude_powershell_credential": True
+}
+# Azure OpenAI 的 AAD 令牌作用域
+COGNITIVE_SERVICES_SCOPE = "https://cognitiveservices.azure.com/.default"
+# 从 Key Vault 读取的密钥（Key Vault 中的名称为把下划线换成连字符，如 AZURE-OPENAI-API-KEY）
+SECRET_NAMES = (
+    "AZURE_OPENAI_API_KEY",
+    "COSMOS_CONNECTION_STRING",
+    "AZURE_STORAGE_CONNECTION_STRING",
+    "AZURE_STORAGE_CONNECTION_STRING_JSON"
+)
+
+# 连接字符串 -> 客户端
+_cosmos_clients: Dict[str, CosmosClient] = {}
+_blob_clients: Dict[str, BlobServiceClient] = {}
+# Foundry 项目连接字符串 -> 客户端
+_project_clients: Dict[str, AIProjectClient] = {}
+# (项目连接字符串, agent_id) -> Foundry Agent，Agent 定义只获取一次
+_foundry_agents: Dict[Tuple[str, str], AzureAIAgent] = {}
+# 每个 Agent 一把锁，并发的首次调用只获取一次定义
+_foundry_agent_locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+# (endpoint, api_key, api_version) -> 客户端
+_openai_clients: Dict[Tuple[str, str, str], AsyncAzureOpenAI] = {}
+# 调用外部 Web API（如合同生成服务）的 HTTP 客户端
+_http_client: Optional[httpx.AsyncClient] = None
+# Cosmos / Blob / Foundry 客户端共用的 aiohttp 会话
+_aiohttp_session: Optional[aiohttp.ClientSession] = None
+# 共享凭据，SDK 在实例内缓存令牌
+_credential: Optional[DefaultAzureCredential] = None
+# 异步数据面客户端（Cosmos / Blob / Key Vault / OpenAI）使用的共享凭据
+_async_credential: Optional[AsyncDefaultAzureCredential] = None
+_secrets_loaded = False
+# 模型调用并发闸门（Azure OpenAI 与 Foundry Agent 共用）
+_llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+# 模型请求速率限制（令牌桶），未设置 LLM_RPM 时不启用
+_llm_rate_limiter: Optional[AsyncLimiter] = AsyncLimiter(LLM_RPM, 60) if LLM_RPM > 0 else None
+
+
+def _get_aiohttp_session() -> aiohttp.ClientSession:
+    """获取共享的 aiohttp 会话（需在事件循环内调用）"""
+    global _aiohttp_session
+    if _aiohttp_session is None or _aiohttp_session.closed:
+        _aiohttp_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=POOL_SIZE,
+                limit_per_host=POOL_SIZE_PER_HOST,
+                keepalive_timeout=AIOHTTP_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=DNS_CACHE_TTL,
+                # 及时回收对端已关闭的 TLS 连接，避免连接池中残留失效连接
+                enable_cleanup_closed=True
+            )
+        )
+    return _aiohttp_session
+
+
+def _build_transport() -> AioHttpTransport:
+    """创建基于共享 aiohttp 会话的传输层，会话由 close_clients() 统一关闭"""
+    return AioHttpTransport(
+        session=_get_aiohttp_session(),
+        session_owner=False,
+        connection_timeout=CONNECTION_TIMEOUT,
+        read_timeout=READ_TIMEOUT
+    )
+
+
+def get_cosmos_client(connection_string: Optional[str] = None) -> CosmosClient:
+    """获取共享的 CosmosClient；未提供连接字符串时通过 COSMOS_ENDPOINT + COSMOS_KEY（未设置时用托管标识）连接"""
+    key = connection_string or os.getenv("COSMOS_ENDPOINT")
+    if not key:
+        raise ValueError("COSMOS_CONNECTION_STRING 或 COSMOS_ENDPOINT 环境变量未设置")
+    client = _cosmos_clients.get(key)
+    if client is None:
+        if connection_string:
+            client = CosmosClient.from_connection_string(
+                connection_string,
+                consistency_level=COSMOS_CONSISTENCY_LEVEL,
+                transport=_build_transport(),
+                **RETRY_SETTINGS
+            )
+        else:
+            client = CosmosClient(
+                key,
+                credential=os.getenv("COSMOS_KEY") or get_async_credential(),
+                consistency_level=COSMOS_CONSISTENCY_LEVEL,
+                transport=_build_transport(),
+                **RETRY_SETTINGS
+            )
+        _cosmos_clients[key] = client
+    return client
+
+
+def _storage_account_url() -> Optional[str]:
+    account_url = os.getenv("AZURE_STORAGE_ACCOUNT_URL")
+    account_name = os.getenv("AZURE_STORAGE_ACCOUNT_NAME")
+    if not account_url and account_name:
+        account_url = f"https://{account_name}.blob.core.windows.net"
+    return account_url
+
+
+def get_blob_service_client(connection_string: Optional[str] = None) -> BlobServiceClient:
+    """获取共享的 BlobServiceClient；未提供连接字符串时通过存储账户 URL + 托管标识连接"""
+    key = connection_string or _storage_account_url()
+    if not key:
+        raise ValueError("AZURE_STORAGE_CONNECTION_STRING 或 AZURE_STORAGE_ACCOUNT_URL 环境变量未设置")
+    client = _blob_clients.get(key)
+    if client is None:
+        if connection_string:
+            client = BlobServiceClient.from_connection_string(
+                connection_string,
+                transport=_build_transport(),
+                **RETRY_SETTINGS
+            )
+        else:
+            client = BlobServiceClient(
+                account_url=key,
+                credential=get_async_credential(),
+                transport=_build_transport(),
+                **RETRY_SETTINGS
+            )
+        _blob_clients[key] = client
+    return client
+
+
+def get_project_client(connection_string: str) -> AIProjectClient:
+    """获取共享的 Foundry AIProjectClient"""
+    client = _project_clients.get(connection_string)
+    if client is None:
+        client = AIProjectClient.from_connection_string(
+            credential=get_credential(),
+            conn_str=connection_string,
+            transport=_build_transport(),
+            **RETRY_SETTINGS
+        )
+        _project_clients[connection_string] = client
+    return client
+
+
+async def get_foundry_agent(connection_string: str, agent_id: str) -> AzureAIAgent:
+    """获取共享的 Foundry AzureAIAgent（首次调用时获取 Agent 定义并缓存）"""
+    key = (connection_string, agent_id)
+    agent = _foundry_agents.get(key)
+    if agent is not None:
+        return agent
+    async with _foundry_agent_locks.setdefault(key, asyncio.Lock()):
+        agent = _foundry_agents.get(key)
+        if agent is None:
+            client = get_project_client(connection_string)
+            definition = await client.agents.get_agent(agent_id=agent_id)
+            agent = _foundry_agents[key] = AzureAIAgent(client=client, definition=definition)
+    return agent
+
+
+async def prewarm_foundry_agents(connection_string: Optional[str], agent_ids: Tuple[str, ...]):
+    """启动时预先获取 Foundry Agent 定义，失败时只记录日志，首次调用时再获取"""
+    if not connection_string:
+        return
+    results = await asyncio.gather(
+        *(get_foundry_agent(connection_string, agent_id) for agent_id in agent_ids),
+        return_exceptions=True
+    )
+    for agent_id, result in zip(agent_ids, results):
+        if isinstance(result, Exception):
+            logger.warning(f"预热 Foundry Agent {agent_id} 失败: {str(result)}")
+
+
+def get_openai_client(endpoint: str, api_key: Optional[str], api_version: str) -> AsyncAzureOpenAI:
+    """获取共享的 AsyncAzureOpenAI 客户端（HTTP/2 多路复用 + keep-alive）
+
+    api_key 为空时使用托管标识获取 AAD 令牌。
+    """
+    key = (endpoint, api_key or "", api_version)
+    client = _openai_clients.get(key)
+    if client is None:
+        auth = {"api_key": api_key} if api_key else {
+            "azure_ad_token_provider": get_bearer_token_provider(
+                get_async_credential(), COGNITIVE_SERVICES_SCOPE
+            )
+        }
+        client = AsyncAzureOpenAI(
+            azure_endpoint=endpoint,
+            api_version=api_version,
+            max_retries=OPENAI_MAX_RETRIES,
+            **auth,
+            http_client=httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(max_keepalive_connections=OPENAI_KEEPALIVE_CONNECTIONS)
+            )
+        )
+        _openai_clients[key] = client
+    return client
+
+
+async def prewarm_openai_client(endpoint: Optional[str], api_key: Optional[str], api_version: Optional[str]):
+    """启动时发一个轻量请求，提前完成 DNS / TLS 握手（及 AAD 令牌获取），失败时只记录日志"""
+    if not endpoint or not api_version:
+        return
+    try:
+        await get_openai_client(endpoint, api_key, api_version).models.list()
+    except Exception as e:
+        logger.warning(f"预热 Azure OpenAI 连接失败: {str(e)}")
+
+
+@asynccontextmanager
+async def llm_slot() -> AsyncIterator[None]:
+    """获取模型调用的并发闸门，调用处使用 async with llm_slot(): ...
+
+    先占用并发名额，再按 LLM_RPM 等待速率配额，请求在本地排队而不是撞上 429；
+    仍出现的限流错误由 SDK 的重试策略（OPENAI_MAX_RETRIES / RETRY_SETTINGS）按 Retry-After 指数退避。
+    """
+    async with _llm_semaphore:
+        if _llm_rate_limiter is not None:
+            await _llm_rate_limiter.acquire()
+        yield
+
+
+# llm_stream 队列中的结束标记
+_STREAM_END = object()
+
+
+async def llm_stream(source: AsyncIterator[Any]) -> AsyncIterator[Any]:
+    """在并发闸门内读取模型流式输出，调用方使用 async for item in llm_stream(...): ...
+
+    后台任务占用 llm_slot 读取模型输出并放入队列，模型生成结束即释放名额；
+    调用方（如 SSE 客户端）读取得慢或中途断开都不会占用并发名额。调用方提前退出时取消后台读取。
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def produce():
+        try:
+            async with llm_slot():
+                async for item in source:
+                    queue.put_nowait(item)
+        except Exception as e:
+            queue.put_nowait(e)
+        finally:
+            queue.put_nowait(_STREAM_END)
+
+    task = asyncio.create_task(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is _STREAM_END:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+def get_credential() -> DefaultAzureCredential:
+    """获取共享的 DefaultAzureCredential（令牌在多次调用间复用）"""
+    global _credential
+    if _credential is None:
+        _credential = DefaultAzureCredential(**CREDENTIAL_EXCLUDES)
+    return _credential
+
+
+def get_async_credential() -> AsyncDefaultAzureCredential:
+    """获取异步客户端共享的 DefaultAzureCredential（生产环境使用托管标识）"""
+    global _async_credential
+    if _async_credential is None:
+        _async_credential = AsyncDefaultAzureCredential(**CREDENTIAL_EXCLUDES)
+    return _async_credential
+
+
+async def load_secrets():
+    """从 Key Vault 读取密钥写入环境变量，只在首次调用时执行
+
+    未配置 AZURE_KEY_VAULT_URL 时直接使用 .env / 环境变量；已设置的环境变量不会被覆盖。
+    """
+    global _secrets_loaded
+    if _secrets_loaded:
+        return
+    _secrets_loaded = True
+    vault_url = os.getenv("AZURE_KEY_VAULT_URL")
+    if not vault_url:
+        return
+    names = [name for name in SECRET_NAMES if not os.getenv(name)]
+    if not names:
+        return
+    async with SecretClient(vault_url=vault_url, credential=get_async_credential()) as client:
+        results = await asyncio.gather(
+            *(client.get_secret(name.replace("_", "-")) for name in names),
+            return_exceptions=True
+        )
+    for name, result in zip(names, results):
+        if isinstance(result, Exception):
+            logger.warning(f"从 Key Vault 读取 {name} 失败: {str(result)}")
+        else:
+            os.environ[name] = result.value
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """获取共享的异步 HTTP 客户端（keep-alive 复用连接）"""
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECTION_TIMEOUT),
+            limits=httpx.Limits(max_connections=POOL_SIZE, keepalive_expiry=KEEPALIVE_EXPIRY)
+        )
+    return _http_client
+
+
+async def close_clients():
+    """关闭所有共享客户端（应用关闭时调用）"""
+    global _http_client, _credential, _async_credential, _aiohttp_session
+    for clients in (_cosmos_clients, _blob_clients, _project_clients):
+        for client in clients.values():
+            try:
+                await client.close()
+            except Exception as e:
+                logger.error(f"关闭客户端失败: {str(e)}")
+        clients.clear()
+    _foundry_agents.clear()
+    _foundry_agent_locks.clear()
+    if _aiohttp_session is not None:
+        await _aiohttp_session.close()
+        _aiohttp_session = None
+    for client in _openai_clients.values():
+        try:
+            await client.close()
+        except Exception as e:
+            logger.error(f"关闭客户端失败: {str(e)}")
+    _openai_clients.clear()
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+    if _credential is not None:
+        _credential.close()
+        _credential = None
+    if _async_credential is not None:
+        await _async_credential.close()
+        _async_credential = None
@@ -2,36 +2,68 @@ from datetime import datetime
 from dateutil.relativedelta import relativedelta
 import os
 import json
-import requests
 import asyncio
-from typing import Dict, Any
-from datetime import datetime
+import time
+import hashlib
+import io
+import orjson
+from typing import Dict, Any, AsyncIterator, Callable, List, Optional, Tuple, Union
+from datetime import datetime, date
 from dotenv import load_dotenv
+from cachetools import TTLCache
+from pypdf import PdfReader
 
 # Azure 服务SDK
-from azure.storage.blob.aio import BlobServiceClient
-from azure.cosmos.aio import CosmosClient
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceNotModifiedError, ResourceNotFoundError
+from azure.cosmos.exceptions import CosmosResourceNotFoundError
+from azure_clients import get_cosmos_client, get_blob_service_client, get_http_client, get_openai_client, llm_slot, llm_stream, load_secrets
 
 # Semantic Kernel
 import semantic_kernel as sk
-from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion
+from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion, AzureChatPromptExecutionSettings
 from semantic_kernel.functions import KernelArguments
-from semantic_kernel.prompt_template import PromptTemplateConfig
+from semantic_kernel.prompt_template import PromptTemplateConfig, KernelPromptTemplate
+
+from llm_batching import BATCH_SIZE, MicroBatcher, parse_batch_output
+from prompt_utils import to_prompt_text, prune_user_info
 
 # 加载环境变量
 load_dotenv()
 
+# 银行内部房贷政策文件（静态文档，进程内缓存）
+LOAN_POLICY_BLOB = "Bank Internal Personal Housing Loan Policy.pdf"
+# 缓存条目在该时间（秒）内直接命中，过期后用 ETag 做条件下载校验
+BLOB_CACHE_TTL = 300
+# 新生成的合同 blob 可能短暂不可见，404 时按指数退避重试
+BLOB_NOT_FOUND_RETRIES = 3
+BLOB_RETRY_BASE_DELAY = 0.2
+# 大文件分块并行下载的并发数
+BLOB_DOWNLOAD_CONCURRENCY = 4
+
+# blob_path -> (etag, 数据, 上次校验时间)
+_blob_cache: Dict[str, Tuple[str, bytes, float]] = {}
+
+# blob_path -> (etag, 提取出的 PDF 文本)
+_pdf_text_cache: Dict[str, Tuple[str, str]] = {}
+# blob_path -> 锁，并发请求共用同一次下载与解析
+_pdf_text_locks: Dict[str, asyncio.Lock] = {}
+
+# 合规审查结果缓存：相同的用户信息、合同与政策内容直接复用上次结论
+_review_cache: TTLCache = TTLCache(maxsize=1024, ttl=3600)
+
+# 合同生成服务
+CONTRACT_SERVICE_URL = "https://pdfcontract-d6hef0cgg0dughhq.eastus2-01.azurewebsites.net/generate_mortgage_contract"
+# 合同数据哈希 -> 已生成的合同文件名，相同的合同数据不重复生成 PDF
+_contract_file_cache: TTLCache = TTLCache(maxsize=1024, ttl=3600)
+
 # --- Cosmos DB 客户端 ---
 class CosmosDBClient:
     """封装与Cosmos DB的交互（使用Connection String连接）"""
     
     def __init__(self):
-        # 从环境变量获取连接字符串
-        connection_string = os.getenv("COSMOS_CONNECTION_STRING")
-        if not connection_string:
-            raise ValueError("COSMOS_CONNECTION_STRING environment variable is not set")
-            
-        self.client = CosmosClient.from_connection_string(connection_string)
+        # 优先使用连接字符串，未设置时通过 COSMOS_ENDPOINT + 托管标识连接
+        self.client = get_cosmos_client(os.getenv("COSMOS_CONNECTION_STRING"))
     
     async def get_user_info(self, applicantId: str) -> Dict[str, Any]:
         """根据user_id获取用户信息"""
@@ -39,30 +71,14 @@ class CosmosDBClient:
             database = self.client.get_database_client("cosmicworks")
             container = database.get_container_client("userinfo")
             
-            # 使用参数化查询（更安全）
-            query = "SELECT * FROM c WHERE c.id = @applicantId"
-            parameters = [
-                {"name": "@applicantId", "value": applicantId}
-            ]
-            
-            items = [
-                item 
-                async for item in container.query_items(
-                    query=query,
-                    parameters=parameters
-                    # 不再需要 enable_cross_partition_query
-                )
-            ]
-            
-            if not items:
+            # 按 id 直接点读（分区键为 id），不经过查询引擎
+            try:
+                return await container.read_item(item=applicantId, partition_key=applicantId)
+            except CosmosResourceNotFoundError:
                 raise ValueError(f"未找到用户ID: {applicantId}")
-            
-            return items[0]
         except Exception as e:
             print(f"[Cosmos DB] 查询失败: {str(e)}")
             raise
-        finally:
-            await self.client.close()
 
 
 # --- Azure Blob 存储操作 ---
@@ -70,99 +86,402 @@ class ContractProofLoader:
     """从Blob Storage加载收入证明"""
     
     def __init__(self):
-        # self.client = BlobServiceClient.from_connection_string("AccountEndpoint=https://hackaloandb.documents.azure.com:443/;AccountKey=nBAAGrW3NayW8oLRgPh4LgJNE6aqidQRFsU12WVsOwjuOUYHFQGh3HyPPeTRYzVUwON1Gj3KE9SIACDbAsD3zQ==;")
-        self.client = BlobServiceClient.from_connection_string(
+        self.client = get_blob_service_client(
                 os.getenv("AZURE_STORAGE_CONNECTION_STRING")
             )
-    async def load_contract_data(self, blob_path: str) -> Dict[str, Any]:
-        """异步加载JSON格式的收入证明"""
+    async def load_contract_data(self, blob_path: str, cache: bool = False) -> Dict[str, Any]:
+        """异步加载JSON格式的收入证明
+
+        cache=True 时使用进程内缓存，适用于政策文件等静态文档
+        """
         try:
             blob_client = self.client.get_blob_client(
                 container="contract",
                 blob=blob_path
             )
-            # 关键修正点：添加await
-            downloader = await blob_client.download_blob()
+            if not cache:
+                for attempt in range(BLOB_NOT_FOUND_RETRIES + 1):
+                    try:
+                        # 关键修正点：添加await
+                        downloader = await blob_client.download_blob(
+                            max_concurrency=BLOB_DOWNLOAD_CONCURRENCY
+                        )
+                        break
+                    except ResourceNotFoundError:
+                        if attempt == BLOB_NOT_FOUND_RETRIES:
+                            raise
+                        await asyncio.sleep(BLOB_RETRY_BASE_DELAY * 2 ** attempt)
+                return await downloader.readall()
+
+            cached = _blob_cache.get(blob_path)
+            if cached:
+                etag, data, checked_at = cached
+                if time.monotonic() - checked_at < BLOB_CACHE_TTL:
+                    return data
+                # 过期后做条件下载，未修改时服务端返回 304，不传输内容
+                try:
+                    downloader = await blob_client.download_blob(
+                        max_concurrency=BLOB_DOWNLOAD_CONCURRENCY,
+                        etag=etag,
+                        match_condition=MatchConditions.IfModified
+                    )
+                except ResourceNotModifiedError:
+                    _blob_cache[blob_path] = (etag, data, time.monotonic())
+                    return data
+            else:
+                downloader = await blob_client.download_blob(
+                    max_concurrency=BLOB_DOWNLOAD_CONCURRENCY
+                )
+
             data = await downloader.readall()
-            #data = await blob_client.download_blob().readall()
-            return data #json.loads(data.decode('utf-8'))
-            
+            _blob_cache[blob_path] = (downloader.properties.etag, data, time.monotonic())
+            return data
+
         except Exception as e:
             print(f"[Blob Storage] 加载失败: {blob_path}, 错误: {str(e)}")
             raise
 
+    async def wait_for_contract(self, blob_path: str):
+        """确认生成的合同已写入 Blob（只读取属性，不下载内容），404 时按指数退避重试"""
+        blob_client = self.client.get_blob_client(
+            container="contract",
+            blob=blob_path
+        )
+        for attempt in range(BLOB_NOT_FOUND_RETRIES + 1):
+            try:
+                return await blob_client.get_blob_properties()
+            except ResourceNotFoundError:
+                if attempt == BLOB_NOT_FOUND_RETRIES:
+                    print(f"[Blob Storage] 合同文件不存在: {blob_path}")
+                    raise
+                await asyncio.sleep(BLOB_RETRY_BASE_DELAY * 2 ** attempt)
+
+    async def load_pdf_text(self, blob_path: str) -> str:
+        """加载静态 PDF 文档并提取文本，同一 ETag 只解析一次"""
+        lock = _pdf_text_locks.setdefault(blob_path, asyncio.Lock())
+        # 冷启动时多个并发请求只触发一次下载，其余请求等待后直接命中缓存
+        async with lock:
+            data = await self.load_contract_data(blob_path, cache=True)
+            etag = _blob_cache[blob_path][0]
+            cached = _pdf_text_cache.get(blob_path)
+            if cached and cached[0] == etag:
+                return cached[1]
+            # PDF 解析是 CPU 密集操作，放到线程中执行
+            text = await asyncio.to_thread(_extract_pdf_text, data)
+            _pdf_text_cache[blob_path] = (etag, text)
+            return text
+
+def _extract_pdf_text(data: bytes) -> str:
+    """提取 PDF 各页文本"""
+    reader = PdfReader(io.BytesIO(data))
+    return "\n".join(page.extract_text() or "" for page in reader.pages)
+
+# 合规审查规则（单个与批量审查共用）
+COMPLIANCE_REVIEW_RULES = """
+                The following information is mainly reviewed：
+                Basic Borrower Qualifications
+                1.Age Requirements:
+                Applicants must be at least 18 years old, and their age at the time of loan maturity must not exceed 60 years old (inclusive).
+                For premium clients or special projects, exceptions may be granted up to 65 years old upon approval from the head office, provided that a co-borrower or additional collateral is secured.
+                2.Credit History:
+                No more than 3 consecutive or 6 cumulative late payments within the past 2 years.
+                No major negative credit records (e.g., bad debts, debt settlements).
+                3.Repayment Capacity:
+                Monthly income must be at least twice the monthly installment (including other liabilities).
+                4.The loan amount shall not exceed 70% of the property's appraised value (for first homes) or 50% (for second homes)
+"""
+
+# 审查结论第一行必须是以下两者之一，下游（提前批准）只按这一行精确判断是否合规
+COMPLIANT_VERDICT = "Compliance: COMPLIANT"
+NON_COMPLIANT_VERDICT = "Compliance: NON_COMPLIANT"
+COMPLIANCE_VERDICT_INSTRUCTION = f"""
+                The first line of your answer must be exactly "{COMPLIANT_VERDICT}" or "{NON_COMPLIANT_VERDICT}" and nothing else.
+                Answer "{NON_COMPLIANT_VERDICT}" if any rule is violated or if the information is insufficient to confirm compliance."""
+
+# 提示词模板在导入时解析一次，所有实例与调用共用
+# 固定的说明、规则与政策全文放在前面、每次不同的数据放在末尾，便于命中 Azure OpenAI 的前缀缓存
+# （政策文本对所有申请相同，是前缀中最大的一块，使稳定前缀达到缓存所需的长度）
+COMPLIANCE_REVIEW_TEMPLATE = KernelPromptTemplate(
+    prompt_template_config=PromptTemplateConfig(
+    template="""
+                You are a professional pre-approval specialist for bank mortgage contracts, responsible for reviewing the compliance of contracts in accordance with the bank's internal rules and regulations before the contract is issued.
+""" + COMPLIANCE_REVIEW_RULES + COMPLIANCE_VERDICT_INSTRUCTION + """
+                After the verdict line, generate a proposal for the loan contract in no more than 3 sentences.
+                Bank internal personal housing loan policy:
+                {{$loan_Policy}}
+                You have user data {{$user_Info}},
+                Key information about the contract {{$contract}}
+                """,
+    template_format="semantic-kernel"
+    )
+)
+
+COMPLIANCE_REVIEW_BATCH_TEMPLATE = KernelPromptTemplate(
+    prompt_template_config=PromptTemplateConfig(
+    template="""
+                You are a professional pre-approval specialist for bank mortgage contracts, responsible for reviewing the compliance of contracts in accordance with the bank's internal rules and regulations before the contract is issued.
+                You will review several independent applications, each with user data and key information about the contract.""" + COMPLIANCE_REVIEW_RULES + COMPLIANCE_VERDICT_INSTRUCTION + """
+                Each application's review starts with its own verdict line, followed by a proposal for the loan contract in no more than 3 sentences.
+                Review each application independently.
+                Bank internal personal housing loan policy (applies to every application):
+                {{$loan_Policy}}
+                Output format only: a JSON array of strings, one review per application, in the same order as the application numbers.
+                Applications:
+                {{$applications}}
+                """,
+    template_format="semantic-kernel"
+    )
+)
+
+# 合规审查是短小的结构化任务，使用更小更快的部署（未配置时使用默认部署）与较低的温度
+COMPLIANCE_TEMPERATURE = 0.2
+# 结论加不超过 3 句建议，限制输出长度（批量调用按批大小放大）
+COMPLIANCE_MAX_TOKENS = 256
+
+# 合同年利率
+LOAN_INTEREST_RATE = 0.0235
+# 可直接判定不合规的硬性规则（取各规则允许的最宽上限，边界情况仍交给模型审查）
+MIN_BORROWER_AGE = 18
+MAX_AGE_AT_MATURITY = 65
+MAX_LTV_RATIO = 0.70
+MIN_INCOME_TO_INSTALLMENT = 2
+# 申请接口尚未收集房产价格，写入 Cosmos 时用的占位值；视为缺失，不做贷款价值比判断
+PLACEHOLDER_PROPERTY_PRICE = 88888
+
+def _monthly_installment(loan_amount: float, loan_term_years: int) -> float:
+    """等额本息月供"""
+    months = loan_term_years * 12
+    monthly_rate = LOAN_INTEREST_RATE / 12
+    return loan_amount * monthly_rate / (1 - (1 + monthly_rate) ** -months)
+
+def _to_number(value: Any, cast: Callable[[Any], Union[int, float]]) -> Optional[Union[int, float]]:
+    """把记录中的字段转换为数值，缺失或不是数值时返回 None（对应规则跳过，交给模型审查）"""
+    if value is None:
+        return None
+    try:
+        return cast(float(value))
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+def _rule_check(user_info: Dict[str, Any]) -> Optional[str]:
+    """用确定性规则预审，明确不合规时返回审查结论，否则返回 None 交给模型审查"""
+    age = _to_number(user_info.get("age"), int)
+    loan_amount = _to_number(user_info.get("loanAmount"), float)
+    loan_term = _to_number(user_info.get("loanTerm"), int)
+    property_price = _to_number(user_info.get("propertyPrice"), float)
+    monthly_income = _to_number(user_info.get("monthlyIncome"), float)
+    if property_price == PLACEHOLDER_PROPERTY_PRICE:
+        property_price = None
+
+    violations = []
+    if age is not None and age < MIN_BORROWER_AGE:
+        violations.append(f"the applicant is {age} years old, below the minimum age of {MIN_BORROWER_AGE}")
+    if age is not None and loan_term and age + loan_term > MAX_AGE_AT_MATURITY:
+        violations.append(f"the applicant would be {age + loan_term} at loan maturity, above the maximum of {MAX_AGE_AT_MATURITY} even with head office approval")
+    if loan_amount and property_price and loan_amount / property_price > MAX_LTV_RATIO:
+        violations.append(f"the loan-to-value ratio is {loan_amount / property_price:.2%}, above the {MAX_LTV_RATIO:.0%} limit")
+    if loan_amount and loan_term and monthly_income is not None:
+        installment = _monthly_installment(loan_amount, loan_term)
+        if monthly_income < MIN_INCOME_TO_INSTALLMENT * installment:
+            violations.append(f"the monthly income of {monthly_income} is less than twice the monthly installment of {installment:.2f}")
+
+    if not violations:
+        return None
+    return (
+        NON_COMPLIANT_VERDICT + "\n"
+        "The contract is not compliant: " + "; ".join(violations) + ". "
+        "It is recommended to reduce the loan amount or shorten the loan term before reissuing the contract."
+    )
+
+def is_compliant(assessment: str) -> bool:
+    """审查结论第一行恰好为合规结论时返回 True（缺失、格式不符或不合规都返回 False）"""
+    first_line = assessment.strip().split("\n", 1)[0].strip()
+    return first_line == COMPLIANT_VERDICT
+
+def _err(message: str) -> Dict[str, Any]:
+    """构造统一格式的错误结果"""
+    return {
+        "status": "error",
+        "message": message,
+        "timestamp": datetime.now().isoformat()
+    }
+
+def _review_cache_key(item: Tuple[str, str, str]) -> str:
+    """根据 (用户信息, 合同, 政策) 计算缓存键"""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in item:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def _contract_data_key(contract_data: Dict[str, Any]) -> str:
+    """根据合同数据计算幂等键（键排序后哈希，与字段顺序无关）"""
+    payload = orjson.dumps(contract_data, option=orjson.OPT_SORT_KEYS, default=str)
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
 class ComplianceReview:
+    # 所有实例共享同一个批处理器，合并并发的审查请求
+    _batcher: Optional[MicroBatcher] = None
     
     def __init__(self):
         self.kernel = sk.Kernel()
         self.kernel.add_service(
             AzureChatCompletion(
                 service_id="credit_ai",
-                # deployment_name="gpt-4o-mini",
-                # endpoint="https://hackathonfound6454649233.openai.azure.com/openai/deployments/gpt-4o-mini/chat/completions?api-version=2025-01-01-preview",
-                # api_key="U4fD1XnytGhxvUlsRYSRL472aImrcK17LbNS5CQfGOTRpkWKAwpzJQQJ99BDACHYHv6XJ3w3AAAAACOGIngS",
-                # api_version="2024-12-01-preview"
-                deployment_name=os.getenv("AZURE_OPENAI_DEPLOYMENT"),
+                deployment_name=os.getenv("AZURE_OPENAI_DEPLOYMENT_MINI") or os.getenv("AZURE_OPENAI_DEPLOYMENT"),
                 endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
                 api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-                api_version=os.getenv("AZURE_OPENAI_API_VERSION")
+                api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
+                # 复用长连接，减少每次调用的建连开销
+                async_client=get_openai_client(
+                    os.getenv("AZURE_OPENAI_ENDPOINT"),
+                    os.getenv("AZURE_OPENAI_API_KEY"),
+                    os.getenv("AZURE_OPENAI_API_VERSION")
+                )
             )
         )
         
         self.compliance_review = self.kernel.add_function(
             plugin_name="complianceReview",
             function_name="compliance_review",
-            prompt_template_config=PromptTemplateConfig(
-            template="""
-                You are a professional pre-approval specialist for bank mortgage contracts, responsible for reviewing the compliance of contracts in accordance with the bank's internal rules and regulations before the contract is issued.
-                You have user data {{$user_Info}},
-                Key information about the contract {{$contract}}
-                The following information is mainly reviewed：
-                Basic Borrower Qualifications
-                1.Age Requirements:
-                Applicants must be at least 18 years old, and their age at the time of loan maturity must not exceed 60 years old (inclusive).
-                For premium clients or special projects, exceptions may be granted up to 65 years old upon approval from the head office, provided that a co-borrower or additional collateral is secured.
-                2.Credit History:
-                No more than 3 consecutive or 6 cumulative late payments within the past 2 years.
-                No major negative credit records (e.g., bad debts, debt settlements).
-                3.Repayment Capacity:
-                Monthly income must be at least twice the monthly installment (including other liabilities).
-                4.The loan amount shall not exceed 70% of the property's appraised value (for first homes) or 50% (for second homes)
-                You need to clearly answer whether the contract is compliant or not, and then generate a proposal for the loan contract in no more than 3 sentences.
-                """
+            prompt_template=COMPLIANCE_REVIEW_TEMPLATE,
+            prompt_execution_settings=AzureChatPromptExecutionSettings(
+                service_id="credit_ai",
+                temperature=COMPLIANCE_TEMPERATURE,
+                max_tokens=COMPLIANCE_MAX_TOKENS
             )
         )
 
-    async def evaluate(self, UserInfo: Dict[str, Any],Contract: Dict[str, Any],LoanPolicy: Dict[str, Any]) -> Dict[str, Any]:
-        try:
+        self.compliance_review_batch = self.kernel.add_function(
+            plugin_name="complianceReview",
+            function_name="compliance_review_batch",
+            prompt_template=COMPLIANCE_REVIEW_BATCH_TEMPLATE,
+            prompt_execution_settings=AzureChatPromptExecutionSettings(
+                service_id="credit_ai",
+                temperature=COMPLIANCE_TEMPERATURE,
+                max_tokens=COMPLIANCE_MAX_TOKENS * BATCH_SIZE
+            )
+        )
+
+        if ComplianceReview._batcher is None:
+            ComplianceReview._batcher = MicroBatcher(self._review_batch)
+
+    async def _review_batch(self, items: List[Tuple[str, str, str]]) -> List[str]:
+        """批量审查，items 为 (用户数据, 合同信息, 政策) 列表"""
+        if len(items) == 1:
+            user_info, contract, loan_policy = items[0]
             # 使用 KernelArguments 替代旧的 Context
             args = KernelArguments(
-                user_Info=str(UserInfo),
-                contract=str(Contract),
-                loan_Policy = str(LoanPolicy)
+                user_Info=user_info,
+                contract=contract,
+                loan_Policy=loan_policy
                 )
-            
-            # 调用函数
-            result = await self.kernel.invoke(self.compliance_review, arguments=args)
+            async with llm_slot():
+                result = await self.kernel.invoke(self.compliance_review, arguments=args)
+            return [str(result)]
+
+        # 批量提示词中只放一份政策文本，政策不同的请求分组审查
+        groups: Dict[str, List[int]] = {}
+        for i, (_, _, loan_policy) in enumerate(items):
+            groups.setdefault(loan_policy, []).append(i)
+        if len(groups) > 1:
+            assessments: List[str] = [""] * len(items)
+            group_results = await asyncio.gather(
+                *(self._review_batch([items[i] for i in indexes]) for indexes in groups.values())
+            )
+            for indexes, results in zip(groups.values(), group_results):
+                for i, result in zip(indexes, results):
+                    assessments[i] = result
+            return assessments
+
+        applications = "\n".join(
+            f"Application {i}:\nUser data: {user_info}\nKey information about the contract: {contract}"
+            for i, (user_info, contract, _) in enumerate(items, 1)
+        )
+        async with llm_slot():
+            result = await self.kernel.invoke(
+                self.compliance_review_batch,
+                arguments=KernelArguments(applications=applications, loan_Policy=items[0][2])
+            )
+        assessments = parse_batch_output(str(result), len(items))
+        if assessments is None:
+            # 批量输出无法解析时逐个审查
+            results = await asyncio.gather(*(self._review_batch([item]) for item in items))
+            return [r[0] for r in results]
+        return assessments
+
+    async def evaluate(self, UserInfo: Dict[str, Any],Contract: Dict[str, Any],LoanPolicy: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            item = (
+                to_prompt_text(prune_user_info(UserInfo)),
+                to_prompt_text(Contract),
+                to_prompt_text(LoanPolicy)
+            )
+            key = _review_cache_key(item)
+            assessment = _review_cache.get(key)
+            if assessment is None:
+                # 通过批处理器调用函数
+                assessment = await self._batcher.submit(item)
+                _review_cache[key] = assessment
             
             return {
                 "status": "success",
-                "assessment": str(result),
+                "assessment": assessment,
                 "timestamp": datetime.now().isoformat()
             }
         except Exception as e:
-            return {
-                "status": "error",
-                "message": str(e),
-                "timestamp": datetime.now().isoformat()
-            }
+            return _err(str(e))
 
-async def compliance_review_workflow(user_id: str) -> Dict[str, Any]:
-    # 检查必要的环境变量
+    async def evaluate_stream(self, UserInfo: Dict[str, Any], Contract: Dict[str, Any], LoanPolicy: Dict[str, Any]) -> AsyncIterator[str]:
+        """流式审查，模型输出逐段产出，完整结论写入缓存"""
+        item = (
+            to_prompt_text(prune_user_info(UserInfo)),
+            to_prompt_text(Contract),
+            to_prompt_text(LoanPolicy)
+        )
+        key = _review_cache_key(item)
+        assessment = _review_cache.get(key)
+        if assessment is not None:
+            yield assessment
+            return
+
+        user_info, contract, loan_policy = item
+        args = KernelArguments(
+            user_Info=user_info,
+            contract=contract,
+            loan_Policy=loan_policy
+            )
+        parts = []
+        # 并发名额只在模型生成期间占用，SSE 客户端读取得慢或断开不会占住名额
+        async for chunk in llm_stream(self.kernel.invoke_stream(self.compliance_review, arguments=args)):
+            text = str(chunk[0]) if chunk else ""
+            if text:
+                parts.append(text)
+                yield text
+        # 流没有产出任何内容时不缓存，避免空结论在缓存期内被 evaluate 和后续流式请求复用
+        if parts:
+            _review_cache[key] = "".join(parts)
+
+# 共享的合规审查实例（Kernel 与提示词函数只创建一次）
+_compliance_review: Optional[ComplianceReview] = None
+
+def get_compliance_review() -> ComplianceReview:
+    """获取共享的 ComplianceReview 实例"""
+    global _compliance_review
+    if _compliance_review is None:
+        _compliance_review = ComplianceReview()
+    return _compliance_review
+
+async def _prepare_review(user_id: str) -> Union[Dict[str, Any], Tuple[Dict[str, Any], Dict[str, Any], str]]:
+    """执行审查前的准备步骤（Step 1~4）
+
+    返回 (用户信息, 合同数据, 政策文本)；出错或硬性规则已判定不合规时直接返回结果字典。
+    """
+    # 首次调用时从 Key Vault 读取密钥
+    await load_secrets()
+
+    # 检查必要的环境变量（Cosmos / Storage / OpenAI 未配置密钥时使用托管标识）
     required_env_vars = [
-        "COSMOS_CONNECTION_STRING",
-        "AZURE_STORAGE_CONNECTION_STRING",
-        "AZURE_OPENAI_API_KEY",
         "AZURE_OPENAI_ENDPOINT",
         "AZURE_OPENAI_DEPLOYMENT",
         "AZURE_OPENAI_API_VERSION"
@@ -170,24 +489,29 @@ async def compliance_review_workflow(user_id: str) -> Dict[str, Any]:
     
     missing_vars = [var for var in required_env_vars if not os.getenv(var)]
     if missing_vars:
-        return {
-            "status": "error",
-            "message": f"缺少必要的环境变量: {', '.join(missing_vars)}",
-            "timestamp": datetime.now().isoformat()
-        }
+        return _err(f"缺少必要的环境变量: {', '.join(missing_vars)}")
 
     # 初始化各客户端
     cosmos_client = CosmosDBClient()
     blob_loader = ContractProofLoader()
-    evaluator = ComplianceReview()
+
+    # 政策文件不依赖用户信息和合同，在后台预取，与 Step 1~3 重叠
+    policy_task = asyncio.create_task(
+        blob_loader.load_pdf_text(LOAN_POLICY_BLOB)
+    )
 
     try:
         # Step 1: 获取用户信息
         user_info = await cosmos_client.get_user_info(user_id)
         if not user_info:
+            return _err(f"未找到用户信息: {user_id}")
+        
+        # 硬性规则已明确不合规时直接返回结论，不再生成合同和调用模型
+        rejection = _rule_check(user_info)
+        if rejection:
             return {
-                "status": "error",
-                "message": f"未找到用户信息: {user_id}",
+                "status": "success",
+                "assessment": rejection,
                 "timestamp": datetime.now().isoformat()
             }
         
@@ -198,16 +522,15 @@ async def compliance_review_workflow(user_id: str) -> Dict[str, Any]:
         loan_amount = float(user_info.get("loanAmount", 0))
         loan_term_years = str(user_info.get("loanTerm"))
         
-        # 处理 loanStartDate 为 None 的情况
+        # 处理 loanStartDate 为 None 的情况，只解析一次
         loan_start_date_str = user_info.get("loanStartDate")
         if loan_start_date_str is None:
-            loan_start_date_str = datetime.now().strftime("%Y-%m-%d")
-        
-        loan_start_date_first = datetime.strptime(loan_start_date_str, "%Y-%m-%d")
-        loan_start_date = str(loan_start_date_first)
-        loan_end_date_first = loan_start_date_first + relativedelta(years=int(user_info.get("loanTerm")))
-        loan_end_date = str(loan_end_date_first)
-        loan_interest_rate = "2.35%"
+            loan_start = date.today()
+        else:
+            loan_start = date.fromisoformat(loan_start_date_str[:10])
+        loan_start_date = loan_start.isoformat()
+        loan_end_date = (loan_start + relativedelta(years=int(user_info.get("loanTerm")))).isoformat()
+        loan_interest_rate = f"{LOAN_INTEREST_RATE:.2%}"
         repayment_method = "Fixed Payment Mortgage"
         repayment_due_date = "3rd day of each month"
         property_address = "Room 1803, Building 5, NAGA Shangyuan (或 NAGA Upper Court), No. 9 Dongzhimennei Street, Dongcheng District, Beijing, China"
@@ -215,7 +538,7 @@ async def compliance_review_workflow(user_id: str) -> Dict[str, Any]:
         property_price = float(user_info.get("propertyPrice", 0))
         
         # 处理 ltv_ratio 计算，避免除以零
-        ltv_ratio = "0.00%" if property_price == 0 else str("{:.2%}".format(loan_amount/property_price))
+        ltv_ratio = "0.00%" if property_price == 0 else f"{loan_amount / property_price:.2%}"
 
         contractData = {
             "borrower_name": borrower_name,
@@ -233,42 +556,61 @@ async def compliance_review_workflow(user_id: str) -> Dict[str, Any]:
             "ltv_ratio": ltv_ratio
         }
 
-        # Step 3: 生成合同
-        web_app_url = "https://pdfcontract-d6hef0cgg0dughhq.eastus2-01.azurewebsites.net/generate_mortgage_contract"
-        response = requests.post(web_app_url, json=contractData)
-        if response.status_code != 200:
-            return {
-                "status": "error",
-                "message": f"合同生成失败: {response.text}",
-                "timestamp": datetime.now().isoformat()
-            }
-            
-        contract_file_path = response.json().get("filename")
-        if not contract_file_path:
-            return {
-                "status": "error",
-                "message": "未获取到合同文件路径",
-                "timestamp": datetime.now().isoformat()
-            }
+        # Step 3: 生成合同（相同的合同数据直接复用已生成的文件）
+        contract_key = _contract_data_key(contractData)
+        contract_file_path = _contract_file_cache.get(contract_key)
+        if contract_file_path is None:
+            response = await get_http_client().post(
+                CONTRACT_SERVICE_URL,
+                json=contractData,
+                # 服务端可据此对重试请求去重
+                headers={"Idempotency-Key": contract_key}
+            )
+            if response.status_code != 200:
+                return _err(f"合同生成失败: {response.text}")
+                
+            contract_file_path = orjson.loads(response.content).get("filename")
+            if not contract_file_path:
+                return _err("未获取到合同文件路径")
+            _contract_file_cache[contract_key] = contract_file_path
 
-        # Step 4: 加载合同和政策文件
-        contract = await blob_loader.load_contract_data(contract_file_path)
-        loanPolicy = await blob_loader.load_contract_data("Bank Internal Personal Housing Loan Policy.pdf")
-        
-        # Step 5: 执行合规审查
-        result = await evaluator.evaluate(user_info, contractData, loanPolicy)
-        return result
+        # Step 4: 确认合同文件已生成（审查使用 contractData，无需下载合同内容），同时等待后台预取的政策文件
+        _, loanPolicy = await asyncio.gather(
+            blob_loader.wait_for_contract(contract_file_path),
+            policy_task
+        )
+        return user_info, contractData, loanPolicy
 
     except Exception as e:
-        return {
-            "status": "error",
-            "message": f"工作流执行失败: {str(e)}",
-            "timestamp": datetime.now().isoformat()
-        }
+        return _err(f"工作流执行失败: {str(e)}")
     finally:
-        # 确保关闭所有客户端
-        await cosmos_client.client.close()
-        await blob_loader.client.close()
+        # 提前返回时取消未完成的预取
+        if not policy_task.done():
+            policy_task.cancel()
+
+async def compliance_review_workflow(user_id: str) -> Dict[str, Any]:
+    prepared = await _prepare_review(user_id)
+    if isinstance(prepared, dict):
+        return prepared
+
+    # Step 5: 执行合规审查
+    return await get_compliance_review().evaluate(*prepared)
+
+async def compliance_review_stream(user_id: str) -> AsyncIterator[str]:
+    """流式合规审查，调用方可以边生成边展示结论
+
+    准备阶段失败（用户不存在、合同生成失败等）时抛出 ValueError，由调用方按错误处理，不作为审查结论输出。
+    """
+    prepared = await _prepare_review(user_id)
+    if isinstance(prepared, dict):
+        if prepared.get("status") == "error":
+            raise ValueError(prepared.get("message", "合规审查失败"))
+        # 硬性规则已判定不合规，直接输出结论
+        yield prepared["assessment"]
+        return
+
+    async for text in get_compliance_review().evaluate_stream(*prepared):
+        yield text
     
 if __name__ == "__main__":
     async def main():
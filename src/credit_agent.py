@@ -11,63 +11,45 @@ pip install semantic-kernel>=1.0.0 azure-ai-foundry azure-storage-blob python-do
 
 import os
 import json
+import hashlib
+import orjson
 import asyncio
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
 from dotenv import load_dotenv
 import logging
+from cachetools import TTLCache
 
 # Azure 服务SDK
-from azure.identity import DefaultAzureCredential
-from azure.storage.blob.aio import BlobServiceClient
+from azure_clients import get_blob_service_client, get_openai_client, llm_slot, load_secrets
+from foundry_agent import get_foundry_client
 
 from azure.ai.projects.aio import AIProjectClient
 from azure.core.credentials import AzureKeyCredential
 
 # Semantic Kernel
 import semantic_kernel as sk
-from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion
+from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion, AzureChatPromptExecutionSettings
 from semantic_kernel.agents import AzureAIAgent, AzureAIAgentThread
-from semantic_kernel.prompt_template import PromptTemplateConfig, InputVariable
+from semantic_kernel.prompt_template import PromptTemplateConfig, InputVariable, KernelPromptTemplate
 from semantic_kernel.contents import ChatHistory
 from semantic_kernel.functions import KernelArguments
 
 from autogen import ConversableAgent, register_function
 
-# --- Foundry 客户端 ---
-class FoundryIncomeAgent:
-    """封装与Foundry AI的交互"""
-    
-    def __init__(self):
-        self.client = AIProjectClient.from_connection_string(
-            credential=DefaultAzureCredential(),
-            conn_str="eastus2.api.azureml.ms;0dd70ca3-209c-42b7-8dbe-2de878b7b127;odl-sandbox-1660037-02;aironwomen",
-        )  
-        print(self.client)
-    async def get_income_blob_path(self, filename: str) -> str:
-        """
-        调用Foundry Agent获取收入证明的Blob路径
-        """    
-        try:
-            agent_definition = await self.client.agents.get_agent(agent_id="asst_cb5vNNrQzB8BDMGms51SMt7A")
-            getBlobPath_agent = AzureAIAgent(client=self.client, definition=agent_definition)
-            thread: AzureAIAgentThread = None
-            response = await getBlobPath_agent.get_response(messages=filename, thread=thread)
-            res = response.message.items[0].text
-            print(f"# {response.name}: {response}")
-            print(response.message.items[0].text)
-            print(f"Full response: {vars(response)}")  # 查看所有属性
-            print(f"Content type: {type(response)}")  # 确认类型
-            thread = response.thread
-            
-            if not response:
-                raise ValueError("Foundry Agent未返回有效的blob_path")
-                
-            return response.message.items[0].text
-            
-        except Exception as e:
-            print(f"[Foundry] 调用失败: {str(e)}")
-            raise
+from llm_batching import BATCH_SIZE, MicroBatcher, parse_batch_output
+from prompt_utils import to_prompt_text, prune_ocr_fields
+
+logger = logging.getLogger(__name__)
+
+# 信用评估结果缓存：(工作证明分析, 银行流水分析) 哈希 -> 评估结论，相同材料不重复调用模型
+_credit_assessment_cache: TTLCache = TTLCache(maxsize=1024, ttl=3600)
+
+# 下载较大的收入证明 JSON 时并行获取的分块数
+BLOB_DOWNLOAD_CONCURRENCY = 4
+
+# 查询收入证明 Blob 路径的 Foundry Agent
+INCOME_AGENT_ID = "asst_cb5vNNrQzB8BDMGms51SMt7A"
 
 # --- Azure Blob 存储操作 ---
 class IncomeProofLoader:
@@ -77,29 +59,29 @@ class IncomeProofLoader:
         # 从环境变量获取容器名称
         container_name = os.getenv("AZURE_STORAGE_CONTAINER_NAME_JSON", "ocrjson")
         self.logger = logging.getLogger("income_loader")
-        self.logger.info(f"使用容器名称: {container_name}")
+        self.logger.info("使用容器名称: %s", container_name)
         
-        self.client = BlobServiceClient.from_connection_string(
-            "DefaultEndpointsProtocol=https;AccountName=hackathonfound1559274341;AccountKey=Foer+fIx7QM9ihnWxnwJrnRx/GA3YydT3UJ4vzVwr4xkfAdHoUacaOqx5CgVwt07vrgLl1N2IA3l+AStAfISnA==;EndpointSuffix=core.windows.net"
+        self.client = get_blob_service_client(
+            os.getenv("AZURE_STORAGE_CONNECTION_STRING_JSON") or os.getenv("AZURE_STORAGE_CONNECTION_STRING")
         )
         self.container_name = container_name
     
     async def load_income_data(self, blob_path: str) -> Dict[str, Any]:
         """异步加载JSON格式的收入证明"""
         try:
-            self.logger.info(f"尝试从容器 {self.container_name} 加载blob: {blob_path}")
+            self.logger.info("尝试从容器 %s 加载blob: %s", self.container_name, blob_path)
             blob_client = self.client.get_blob_client(
                 container=self.container_name,
                 blob=blob_path
             )
             
-            # 下载blob内容
-            downloader = await blob_client.download_blob()
+            # 下载blob内容（超过单次读取大小时并行下载分块）
+            downloader = await blob_client.download_blob(max_concurrency=BLOB_DOWNLOAD_CONCURRENCY)
             data = await downloader.readall()
             
-            # 解析JSON数据
-            result = json.loads(data.decode('utf-8'))
-            self.logger.info(f"成功加载blob数据: {blob_path}")
+            # 解析JSON数据（orjson 直接解析字节）
+            result = orjson.loads(data)
+            self.logger.info("成功加载blob数据: %s", blob_path)
             return result
             
         except Exception as e:
@@ -107,8 +89,73 @@ class IncomeProofLoader:
             raise
     
 # --- 信用评估核心 ---
+# 单个申请人评估结论（评级 + 1~2 句风险摘要）的输出上限
+CREDIT_MAX_TOKENS = 128
+
+# 信用评级标准（单个与批量评估共用）
+CREDIT_RATING_RULES = """
+            You need to analyze these two data sources together to identify potential risk signals:
+            1.Check if the salary level in the employment certificate matches the bank statements - is there any income exaggeration?
+            2.If the applicant has debt, calculate the DTI (including mortgage, auto loans, and credit card payments) and verify if it exceeds the 50% threshold.
+            3.Use your professional judgment to determine if the user's credit qualifies for loan services.
+            Credit rating standards:
+            A: All data consistent, no risks
+            B: Minor discrepancies, manual review advised
+            C: High-risk (e.g., DTI exceeds limit or document falsification)
+"""
+
+# 提示词模板在导入时解析一次，所有实例与调用共用
+# 固定的说明与规则放在前面、每次不同的数据放在末尾，便于命中 Azure OpenAI 的前缀缓存
+ASSESS_CREDIT_TEMPLATE = KernelPromptTemplate(
+    prompt_template_config=PromptTemplateConfig(
+    template="""
+            You are a professional credit risk analyst.
+            You will receive the extracted employment certificate information and bank statements information.""" + CREDIT_RATING_RULES + """            Output format only: a JSON object {"grade": "A" | "B" | "C", "summary": "1-2 sentence risk summary"}
+            The extracted employment certificate information: 
+            {{$COE}}
+            bank statements information: 
+            {{$BS}}
+            """,
+    template_format="semantic-kernel"
+    )
+)
+
+ASSESS_CREDIT_BATCH_TEMPLATE = KernelPromptTemplate(
+    prompt_template_config=PromptTemplateConfig(
+    template="""
+            You are a professional credit risk analyst.
+            You will receive several independent applicants, each with extracted employment certificate information and bank statements information.""" + CREDIT_RATING_RULES + """            Assess each applicant independently.
+            Output format only: a JSON array of strings, one per applicant, in the same order as the applicant numbers, each string being:
+            The user's credit grade is [A/B/C]. [1-2 sentence risk summary]
+            Applicants:
+            {{$applicants}}
+            """,
+    template_format="semantic-kernel"
+    )
+)
+
+def _assessment_cache_key(item: Tuple[str, str]) -> str:
+    """根据 (工作证明分析, 银行流水分析) 计算缓存键"""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in item:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def _format_assessment(output: str) -> str:
+    """把 {"grade", "summary"} 结构化输出还原为原有的评估结论文本，无法解析时原样返回"""
+    try:
+        assessment = orjson.loads(output)
+    except ValueError:
+        return output
+    if not isinstance(assessment, dict) or not assessment.get("grade"):
+        return output
+    return f"The user's credit grade is {assessment['grade']}. {assessment.get('summary', '')}".rstrip()
+
 class CreditEvaluator:
     """极简信用评估（仅基于月收入）"""
+    # 所有实例共享同一个批处理器，合并并发的评估请求
+    _batcher: Optional[MicroBatcher] = None
     
     def __init__(self):
         self.logger = logging.getLogger("credit_evaluator")
@@ -117,13 +164,18 @@ class CreditEvaluator:
         self.kernel = sk.Kernel()
         self.logger.info("SK Kernel 创建成功")
         
+        endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
+        api_key = os.getenv("AZURE_OPENAI_API_KEY")
+        api_version = os.getenv("AZURE_OPENAI_API_VERSION", "2024-12-01-preview")
         self.kernel.add_service(
             AzureChatCompletion(
                 service_id="credit_ai",
-                deployment_name="gpt-4o-mini",
-                endpoint="https://hackathonfound6454649233.openai.azure.com/openai/deployments/gpt-4o-mini/chat/completions?api-version=2025-01-01-preview",
-                api_key="U4fD1XnytGhxvUlsRYSRL472aImrcK17LbNS5CQfGOTRpkWKAwpzJQQJ99BDACHYHv6XJ3w3AAAAACOGIngS",
-                api_version="2024-12-01-preview"
+                deployment_name=os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4o-mini"),
+                endpoint=endpoint,
+                api_key=api_key,
+                api_version=api_version,
+                # 复用长连接，减少每次调用的建连开销
+                async_client=get_openai_client(endpoint, api_key, api_version)
             )
         )
         self.logger.info("AzureChatCompletion 服务已添加到 Kernel")
@@ -131,99 +183,147 @@ class CreditEvaluator:
         self.assess_credit = self.kernel.add_function(
             plugin_name="CreditServices",
             function_name="AssessCreditRisk",
-            prompt_template_config=PromptTemplateConfig(
-            template="""
-            You are a professional credit risk analyst.
-            You now have the extracted employment certificate information: 
-            {{$COE}}
-            bank statements information: 
-            {{$BS}}
-            You need to analyze these two data sources together to identify potential risk signals:
-            1.Check if the salary level in the employment certificate matches the bank statements - is there any income exaggeration?
-            2.If the applicant has debt, calculate the DTI (including mortgage, auto loans, and credit card payments) and verify if it exceeds the 50% threshold.
-            3.Use your professional judgment to determine if the user's credit qualifies for loan services.
-            Credit rating standards:
-            A: All data consistent, no risks
-            B: Minor discrepancies, manual review advised
-            C: High-risk (e.g., DTI exceeds limit or document falsification)
-            Output format only:
-            The user's credit grade is [A/B/C]. [1-2 sentence risk summary]
-            """,
-            function_name="assess_credit"
+            prompt_template=ASSESS_CREDIT_TEMPLATE,
+            # 评级结论很短，要求 JSON 输出、限制输出长度并使用确定性输出
+            prompt_execution_settings=AzureChatPromptExecutionSettings(
+                service_id="credit_ai",
+                response_format={"type": "json_object"},
+                temperature=0.0,
+                max_tokens=CREDIT_MAX_TOKENS
             )
         )
         self.logger.info("信用评估函数已添加到 Kernel")
+
+        self.assess_credit_batch = self.kernel.add_function(
+            plugin_name="CreditServices",
+            function_name="AssessCreditRiskBatch",
+            prompt_template=ASSESS_CREDIT_BATCH_TEMPLATE,
+            prompt_execution_settings=AzureChatPromptExecutionSettings(
+                service_id="credit_ai",
+                temperature=0.0,
+                max_tokens=CREDIT_MAX_TOKENS * BATCH_SIZE
+            )
+        )
+
+        if CreditEvaluator._batcher is None:
+            CreditEvaluator._batcher = MicroBatcher(self._assess_batch)
+
+    async def _assess_batch(self, items: List[Tuple[str, str]]) -> List[str]:
+        """批量评估，items 为 (工作证明分析, 银行流水分析) 列表"""
+        if len(items) == 1:
+            coe_analysis, bs_analysis = items[0]
+            # 使用 KernelArguments 替代旧的 Context
+            args = KernelArguments(
+                COE=coe_analysis,
+                BS=bs_analysis
+                )
+            self.logger.debug("准备调用 SK 函数 assess_credit，参数: %s", args)
+            async with llm_slot():
+                result = await self.kernel.invoke(self.assess_credit, arguments=args)
+            return [_format_assessment(str(result))]
+
+        applicants = "\n".join(
+            f"Applicant {i}:\nemployment certificate information: {coe_analysis}\nbank statements information: {bs_analysis}"
+            for i, (coe_analysis, bs_analysis) in enumerate(items, 1)
+        )
+        async with llm_slot():
+            result = await self.kernel.invoke(
+                self.assess_credit_batch,
+                arguments=KernelArguments(applicants=applicants)
+            )
+        assessments = parse_batch_output(str(result), len(items))
+        if assessments is None:
+            # 批量输出无法解析时逐个评估
+            self.logger.warning("批量评估结果无法解析，改为逐个评估")
+            results = await asyncio.gather(*(self._assess_batch([item]) for item in items))
+            return [r[0] for r in results]
+        return assessments
     
     async def evaluate(self, CertificateOfEmployment: Dict[str, Any],BankStatements: Dict[str, Any]) -> Dict[str, Any]:
         try:
             self.logger.info("开始信用评估流程")
-            self.logger.debug(f"输入数据 - CertificateOfEmployment: {CertificateOfEmployment}")
-            self.logger.debug(f"输入数据 - BankStatements: {BankStatements}")
+            self.logger.debug("输入数据 - CertificateOfEmployment: %s", CertificateOfEmployment)
+            self.logger.debug("输入数据 - BankStatements: %s", BankStatements)
             
             # 检查输入数据是否为空
             if not CertificateOfEmployment or not BankStatements:
                 raise ValueError("输入数据为空")
             
-            # 获取分析结果，如果不存在则使用空字符串
-            coe_analysis = CertificateOfEmployment.get("openai_analysis", "")
-            bs_analysis = BankStatements.get("openai_analysis", "")
+            # 获取分析结果，如果不存在则使用空字符串；去掉版面 / 置信度字段以缩短提示词
+            coe_analysis = prune_ocr_fields(CertificateOfEmployment.get("openai_analysis", ""))
+            bs_analysis = prune_ocr_fields(BankStatements.get("openai_analysis", ""))
             
-            # 使用 KernelArguments 替代旧的 Context
-            args = KernelArguments(
-                COE=str(coe_analysis),
-                BS=str(bs_analysis)
-                )
-            
-            self.logger.info(f"准备调用 SK 函数 assess_credit，参数: {args}")
-            # 调用函数
-            result = await self.kernel.invoke(self.assess_credit, arguments=args)
-            self.logger.info(f"SK 函数调用成功，结果: {result}")
+            item = (to_prompt_text(coe_analysis), to_prompt_text(bs_analysis))
+            key = _assessment_cache_key(item)
+            result = _credit_assessment_cache.get(key)
+            if result is None:
+                # 通过批处理器调用函数
+                result = await self._batcher.submit(item)
+                _credit_assessment_cache[key] = result
+                self.logger.info("SK 函数调用成功，结果: %s", result)
             
             # 只返回 assessment 内容
             # return str(result)
             return {
                 "status": "success",
-                "assessment": str(result),
+                "assessment": result,
                 "timestamp": datetime.now().isoformat()
             }
         except Exception as e:
             self.logger.error(f"SK 函数调用失败: {str(e)}", exc_info=True)
             return f"评估失败: {str(e)}"
 
+# 共享的信用评估实例（Kernel 与提示词函数只创建一次）
+_credit_evaluator: Optional[CreditEvaluator] = None
+
+def get_credit_evaluator() -> CreditEvaluator:
+    """获取共享的 CreditEvaluator 实例"""
+    global _credit_evaluator
+    if _credit_evaluator is None:
+        _credit_evaluator = CreditEvaluator()
+    return _credit_evaluator
+
 async def credit_analysis_workflow(CertificateOfEmployment: str, BankStatements: str) -> str:
+    # 首次调用时从 Key Vault 读取密钥
+    await load_secrets()
+
     # 初始化各客户端
-    foundry_agent = FoundryIncomeAgent()
+    foundry_client = get_foundry_client()
     blob_loader = IncomeProofLoader()
-    evaluator = CreditEvaluator()
+    evaluator = get_credit_evaluator()
 
     try:
         # 验证输入参数
         if not CertificateOfEmployment or not BankStatements:
             raise ValueError("工作证明或银行流水文件名为空")
             
-        # Step 1: 获取Blob路径
-        COE_blob_path = await foundry_agent.get_income_blob_path(CertificateOfEmployment)
-        BS_blob_path = await foundry_agent.get_income_blob_path(BankStatements)
+        # Step 1: 获取Blob路径（两次查询互不依赖，并发执行）
+        COE_blob_path, BS_blob_path = await asyncio.gather(
+            foundry_client.invoke(INCOME_AGENT_ID, CertificateOfEmployment),
+            foundry_client.invoke(INCOME_AGENT_ID, BankStatements)
+        )
         
         if not COE_blob_path or not BS_blob_path:
             raise ValueError("无法获取文件路径")
             
-        print("COE_blob_path："+COE_blob_path)
-        print("BS_blob_path："+BS_blob_path)
+        logger.debug("COE_blob_path：%s", COE_blob_path)
+        logger.debug("BS_blob_path：%s", BS_blob_path)
         
-        # Step 2: 加载收入证明
-        COE_data = await blob_loader.load_income_data(COE_blob_path)
-        BS_data = await blob_loader.load_income_data(BS_blob_path)
+        # Step 2: 加载收入证明（并发下载）
+        COE_data, BS_data = await asyncio.gather(
+            blob_loader.load_income_data(COE_blob_path),
+            blob_loader.load_income_data(BS_blob_path)
+        )
         
         if not COE_data or not BS_data:
             raise ValueError("无法加载收入证明数据")
             
-        print(COE_data)
-        print(BS_data)
+        logger.debug("工作证明数据: %s", COE_data)
+        logger.debug("银行流水数据: %s", BS_data)
         
         # Step 3: 信用评估
         result = await evaluator.evaluate(COE_data, BS_data)
-        print(result)
+        logger.debug("信用评估结果: %s", result)
         return result
     except Exception as e:
         return f"工作流执行失败: {str(e)}"
@@ -1,59 +1,45 @@
+import os
 import json
 import asyncio
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, AsyncIterator, Optional
 
-from azure.identity import DefaultAzureCredential
-from azure.ai.projects.aio import AIProjectClient
-from semantic_kernel.agents import AzureAIAgent
+from foundry_agent import get_foundry_client
 import logging
 
 logger = logging.getLogger(__name__)
 
 from autogen import ConversableAgent
 
+# 贷款决策 Foundry Agent
+DECISION_AGENT_ID = "asst_pn3mmhpcgLJjJC14xAmLGqvC"
+
 # --- 代理 Foundry 中的决策 Agent ---
 class FoundryDecisionAgent:
-    def __init__(self):
-        self.client = AIProjectClient.from_connection_string(
-            credential=DefaultAzureCredential(),
-            conn_str="eastus2.api.azureml.ms;0dd70ca3-209c-42b7-8dbe-2de878b7b127;odl-sandbox-1660037-02;aironwomen",
-        )
-
     async def call_decision_agent(self, input: str) -> str:
         """
         Call Foundry Agent for loan decision, based on previous agent outputs
         """
         try:
-            agent_definition = await self.client.agents.get_agent(agent_id="asst_pn3mmhpcgLJjJC14xAmLGqvC")
-            agent = AzureAIAgent(client=self.client, definition=agent_definition)
-            response = await agent.get_response(messages=input, thread=None)
-            
-            # 处理不同类型的响应
-            if hasattr(response, 'message') and hasattr(response.message, 'content'):
-                return response.message.content
-            elif hasattr(response, 'content'):
-                return str(response.content)
-            elif isinstance(response, str):
-                return response
-            else:
-                logger.error(f"Unexpected response type: {type(response)}")
-                return "No valid response content found"
+            return await get_foundry_client().invoke(DECISION_AGENT_ID, input)
         except Exception as e:
             logger.error(f"Error calling Foundry decision agent: {str(e)}")
             return f"[ERROR calling Foundry decision agent]: {str(e)}"
-        finally:
-            if hasattr(self, 'client'):
-                await self.client.close()
+
+    def stream_decision_agent(self, input: str) -> AsyncIterator[str]:
+        """
+        Stream the Foundry decision agent's answer as it is generated
+        """
+        return get_foundry_client().invoke_stream(DECISION_AGENT_ID, input)
 
 # --- AutoGen Agent 封装 ---
 class LoanDecisionAgent(ConversableAgent):
     def __init__(self, name="LoanDecisionAgent"):
         llm_config = {
             "config_list": [{
-                "model": "gpt-4o-mini",
-                "api_key": "U4fD1XnytGhxvUlsRYSRL472aImrcK17LbNS5CQfGOTRpkWKAwpzJQQJ99BDACHYHv6XJ3w3AAAAACOGIngS",
-                "base_url": "https://hackathonfound6454649233.openai.azure.com/openai/deployments/gpt-4o-mini/chat/completions?api-version=2025-01-01-preview"
+                "model": os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4o-mini"),
+                "api_key": os.getenv("AZURE_OPENAI_API_KEY"),
+                "base_url": os.getenv("AZURE_OPENAI_ENDPOINT")
             }]
         }
 
@@ -77,6 +63,21 @@ class LoanDecisionAgent(ConversableAgent):
         self.make_loan_decision = make_loan_decision
         self.register_function({"make_loan_decision": make_loan_decision})
 
+    async def make_loan_decision_stream(self, summary_input: str) -> AsyncIterator[str]:
+        """流式调用 Foundry 决策 Agent，逐段产出决策文本"""
+        async for text in FoundryDecisionAgent().stream_decision_agent(summary_input):
+            yield text
+
+# 共享的决策 Agent 实例（autogen 代理与模型客户端只创建一次）
+_loan_decision_agent: Optional[LoanDecisionAgent] = None
+
+def get_loan_decision_agent() -> LoanDecisionAgent:
+    """获取共享的 LoanDecisionAgent 实例"""
+    global _loan_decision_agent
+    if _loan_decision_agent is None:
+        _loan_decision_agent = LoanDecisionAgent()
+    return _loan_decision_agent
+
 # --- 示例调用 ---
 async def demo():
     # 示例输入：其他 Agent 总结输出
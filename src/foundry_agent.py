@@ -0,0 +1,52 @@
+"""
+Foundry Agent 调用
+信用、欺诈、决策工作流共用同一个 FoundryAgentClient，调用时指定 agent_id；
+底层的 AIProjectClient 与 Agent 定义由 azure_clients 统一缓存。
+"""
+
+import os
+import logging
+from typing import AsyncIterator, Optional
+
+from azure_clients import get_foundry_agent, llm_slot, llm_stream
+
+logger = logging.getLogger("foundry_agent")
+
+
+class FoundryAgentClient:
+    """封装与Foundry AI的交互"""
+
+    def __init__(self, connection_string: Optional[str] = None):
+        self.connection_string = connection_string or os.getenv("AZURE_AI_PROJECT_CONNECTION_STRING")
+
+    async def invoke(self, agent_id: str, message: str) -> str:
+        """向指定的 Foundry Agent 发送消息并返回回复文本（每次调用使用新的会话线程）"""
+        agent = await get_foundry_agent(self.connection_string, agent_id)
+        async with llm_slot():
+            response = await agent.get_response(messages=message, thread=None)
+        if not response:
+            raise ValueError(f"Foundry Agent {agent_id} 未返回有效结果")
+        content = response.message.content
+        logger.debug("Foundry Agent %s 返回: %s", agent_id, content)
+        return str(content)
+
+    async def invoke_stream(self, agent_id: str, message: str) -> AsyncIterator[str]:
+        """向指定的 Foundry Agent 发送消息，回复文本按生成顺序逐段产出"""
+        agent = await get_foundry_agent(self.connection_string, agent_id)
+        # 并发名额只在模型生成期间占用，不随调用方的读取速度延长
+        async for response in llm_stream(agent.invoke_stream(messages=message, thread=None)):
+            text = response.message.content
+            if text:
+                yield str(text)
+
+
+# 共享的 Foundry 调用实例
+_foundry_client: Optional[FoundryAgentClient] = None
+
+
+def get_foundry_client() -> FoundryAgentClient:
+    """获取共享的 FoundryAgentClient 实例"""
+    global _foundry_client
+    if _foundry_client is None:
+        _foundry_client = FoundryAgentClient()
+    return _foundry_client
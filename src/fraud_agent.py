@@ -1,27 +1,29 @@
 import os
 import json
 import asyncio
-from typing import Dict, List, Any
+import hashlib
+import orjson
+from typing import Dict, List, Any, Optional
 from datetime import datetime
 from dotenv import load_dotenv
 import logging
+from cachetools import TTLCache
+
+from prompt_utils import to_prompt_text
+
+logger = logging.getLogger(__name__)
 
 # Azure 服务SDK
-from azure.identity import DefaultAzureCredential
-from azure.storage.blob.aio import BlobServiceClient
-from azure.cosmos.aio import CosmosClient
-from azure.ai.projects.aio import AIProjectClient
+from azure.cosmos.exceptions import CosmosResourceNotFoundError
+from azure_clients import get_cosmos_client, get_openai_client, llm_slot, load_secrets
+from foundry_agent import get_foundry_client
 from azure.core.credentials import AzureKeyCredential
 
 # Semantic Kernel
 import semantic_kernel as sk
-from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion
-from semantic_kernel.agents import ChatCompletionAgent, AgentGroupChat, AzureAIAgent
-from semantic_kernel.agents.strategies import SequentialSelectionStrategy, DefaultTerminationStrategy
+from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion, AzureChatPromptExecutionSettings
 from semantic_kernel.functions import KernelArguments, KernelFunctionFromPrompt
-from semantic_kernel.prompt_template import PromptTemplateConfig, InputVariable
-from semantic_kernel.contents import ChatHistory
-from semantic_kernel.contents.chat_message_content import ChatMessageContent
+from semantic_kernel.prompt_template import PromptTemplateConfig, InputVariable, KernelPromptTemplate
 from semantic_kernel.connectors.ai.prompt_execution_settings import PromptExecutionSettings
 
 # --- Cosmos DB 客户端 ---
@@ -30,15 +32,15 @@ class CosmosDBClient:
     
     def __init__(self):
         self.logger = logging.getLogger("cosmos_client")
-        # 从环境变量获取连接字符串
+        # 优先使用连接字符串，未设置时通过 COSMOS_ENDPOINT + 托管标识连接
         connection_string = os.getenv("COSMOS_CONNECTION_STRING")
-        if not connection_string:
-            error_msg = "COSMOS_CONNECTION_STRING environment variable is not set"
+        if not connection_string and not os.getenv("COSMOS_ENDPOINT"):
+            error_msg = "COSMOS_CONNECTION_STRING or COSMOS_ENDPOINT environment variable is not set"
             self.logger.error(error_msg)
             raise ValueError(error_msg)
             
         try:
-            self.client = CosmosClient.from_connection_string(connection_string)
+            self.client = get_cosmos_client(connection_string)
             self.logger.info("Successfully connected to Cosmos DB")
         except Exception as e:
             error_msg = f"Failed to connect to Cosmos DB: {str(e)}"
@@ -48,98 +50,35 @@ class CosmosDBClient:
     async def get_user_info(self, user_id: str) -> Dict[str, Any]:
         """根据user_id获取用户信息"""
         try:
-            self.logger.info(f"Fetching user info for ID: {user_id}")
+            self.logger.info("Fetching user info for ID: %s", user_id)
             database = self.client.get_database_client("cosmicworks")
             container = database.get_container_client("userinfo")
             
-            # 使用参数化查询（更安全）
-            query = "SELECT * FROM c WHERE c.id = @user_id"
-            parameters = [
-                {"name": "@user_id", "value": user_id}
-            ]
-            
-            items = [
-                item 
-                async for item in container.query_items(
-                    query=query,
-                    parameters=parameters
-                )
-            ]
-            
-            if not items:
+            # 按 id 直接点读（分区键为 id），不经过查询引擎
+            try:
+                item = await container.read_item(item=user_id, partition_key=user_id)
+            except CosmosResourceNotFoundError:
                 error_msg = f"User not found with ID: {user_id}"
                 self.logger.warning(error_msg)
                 raise ValueError(error_msg)
             
-            self.logger.info(f"Successfully retrieved user info for ID: {user_id}")
-            return items[0]
+            self.logger.info("Successfully retrieved user info for ID: %s", user_id)
+            return item
         except Exception as e:
             error_msg = f"Failed to query Cosmos DB: {str(e)}"
             self.logger.error(error_msg)
             raise
-        finally:
-            try:
-                await self.client.close()
-                self.logger.info("Cosmos DB connection closed")
-            except Exception as e:
-                self.logger.error(f"Error closing Cosmos DB connection: {str(e)}")
-
 
-# --- Foundry 客户端 ---
-class FoundryIncomeAgent:
-    """封装与Foundry AI的交互"""
-    
-    def __init__(self):
-        self.client = AIProjectClient.from_connection_string(
-            credential=DefaultAzureCredential(),
-            conn_str="eastus2.api.azureml.ms;0dd70ca3-209c-42b7-8dbe-2de878b7b127;odl-sandbox-1660037-02;aironwomen",
-        )  
-    
-    async def get_EvidenceOfFraud_blob_path(self, userName: str) -> str:
-        """
-        调用Foundry Agent获取调用web api获取用户欺诈风险调查结果
-        """    
-        try:
-            agent_definition = await self.client.agents.get_agent(agent_id="asst_zvCohHloGovi4OvDnQLTKkbd")
-            getBlobPath_agent = AzureAIAgent(client=self.client, definition=agent_definition)
-            response = await getBlobPath_agent.get_response(messages=userName)
-            
-            # 安全处理响应
-            if hasattr(response, 'content'):
-                return str(response.content)
-            elif isinstance(response, str):
-                return response
-            else:
-                raise ValueError("无法解析Foundry Agent响应")
-        except Exception as e:
-            print(f"[Foundry] 调用失败: {str(e)}")
-            raise
 
+# 查询反欺诈调查结果的 Foundry Agent
+FRAUD_EVIDENCE_AGENT_ID = "asst_zvCohHloGovi4OvDnQLTKkbd"
 
 # --- 欺诈检测核心 ---
-class FraudEvaluator:
-    def __init__(self):
-        self.logger = logging.getLogger("fraud_evaluator")
-        
-        self.kernel = sk.Kernel()
-        self.logger.info("初始化 SK Kernel")
-        
-        self.kernel.add_service(
-            AzureChatCompletion(
-                service_id="credit_ai",
-                deployment_name="gpt-4o-mini",
-                endpoint="https://hackathonfound6454649233.openai.azure.com/openai/deployments/gpt-4o-mini/chat/completions?api-version=2025-01-01-preview",
-                api_key="U4fD1XnytGhxvUlsRYSRL472aImrcK17LbNS5CQfGOTRpkWKAwpzJQQJ99BDACHYHv6XJ3w3AAAAACOGIngS",
-                api_version="2024-12-01-preview"
-            )
-        )
-        self.logger.info("添加 AzureChatCompletion 服务到 Kernel")
-        
-        # 初始化真正的Agent实例
-        self.risk_agent = ChatCompletionAgent(
-            kernel=self.kernel,
-            name="risk_agent",
-            instructions="""
+# 欺诈评估结果缓存：证据内容相同时直接复用上次的 (决策, 讨论记录)
+_fraud_review_cache: TTLCache = TTLCache(maxsize=10000, ttl=3600)
+
+# 风险专家与客户经理的角色说明（原群聊中两个 Agent 的 instructions）
+RISK_AGENT_INSTRUCTIONS = """
             You are an expert in anti fraud in banks and will pay special attention to the risk points of information：
             1.Identity Consistency:Name, ID number, and phone number match official records.No discrepancies in personal information.
             2.Social Insurance Verification:Consistent payments for the last 3 months from the same employer.Employer name matches the application details .
@@ -149,75 +88,49 @@ class FraudEvaluator:
             6.Legal & Credit History:No criminal records.Zero overdue records in credit history .
             
             Risk points must be clearly identified upon discovery.To completely eliminate the occurrence of fraud.
-            """,
-            description="anti fraud"
-        )
-        self.logger.info("初始化风险分析 Agent")
-        
-        self.service_agent = ChatCompletionAgent(
-            kernel=self.kernel,
-            name="service_agent",
-            instructions="""
+"""
+
+SERVICE_AGENT_INSTRUCTIONS = """
             You are the customer manager of the bank, responsible for helping users explain the rationality of materials. You will focus on the user's contributions and advantages, assist users in completing loan approval, and list the following key information of the user:
             1. Special and reasonable circumstances
             2. Possibility of supplementary materials
             3. Customer historical contributions
-            """,
-            description="customer manager"
-        )
-        self.logger.info("初始化客户服务 Agent")
-        
-        # 群聊设置
-        self.group_chat = AgentGroupChat(
-            agents=[self.risk_agent, self.service_agent],
-            selection_strategy=SequentialSelectionStrategy(),
-            termination_strategy=DefaultTerminationStrategy(maximum_iterations=3)
-        )
-        self.logger.info("初始化 Agent 群聊")
-    
-    async def evaluate(self, evidence_data: Dict[str, Any]) -> Dict[str, Any]:
-        try:
-            self.logger.info("开始欺诈评估")
-            # 1. 直接将证据数据转换为字符串作为初始提示
-            evidence_str = json.dumps(evidence_data, ensure_ascii=False)
-            self.logger.info(f"准备评估数据: {evidence_str}")
-            
-            # 2. 创建初始消息内容
-            initial_message = ChatMessageContent(
-                role="user",
-                content=f"请分析以下欺诈证据数据：\n{evidence_str}"
-            )
-            
-            # 3. 直接添加到群聊（不需要ChatHistory）
-            self.logger.info("开始 Agent 群聊")
-            await self.group_chat.add_chat_message(initial_message)
-            
-            # 4. 收集响应
-            discussion = []
-            async for msg in self.group_chat.invoke():
-                if isinstance(msg, ChatMessageContent):
-                    discussion.append(f"{msg.role}: {msg.content}")
-                    self.logger.info(f"收到 Agent 消息: {msg.role}: {msg.content}")
+"""
 
-            # 5. 生成最终决策
-            if not discussion:
-                self.logger.error("讨论记录为空，无法生成决策")
-                raise ValueError("讨论记录为空，无法生成决策")
-            
-            # 1. 将讨论内容格式化为更清晰的对话记录
-            formatted_discussion = "\n".join([
-                f"【{msg.split(':')[0]}】{msg.split(':', 1)[1].strip()}"
-                for msg in discussion
-            ])
-        
-            self.logger.info("=== 完整讨论记录 ===")
-            self.logger.info(formatted_discussion)
+# 一次调用同时给出风险专家、客户经理的意见和最终裁决，替代多轮群聊 + 总结
+FRAUD_REVIEW_TEMPLATE = KernelPromptTemplate(
+    prompt_template_config=PromptTemplateConfig(
+    template="""
+            You will review fraud evidence for a bank loan application by playing two experts and then an arbiter.
+            Expert risk_agent:""" + RISK_AGENT_INSTRUCTIONS + """
+            Expert service_agent:""" + SERVICE_AGENT_INSTRUCTIONS + """
+            Arbiter:
+            Please make a final decision based on the opinions of both experts, adopt more positive opinions, and try to approve the loan as much as possible.
+            Decision requirements:
+            1. Comprehensive risk analysis and service recommendations
+            2. Clear conclusion: approved or rejected
+            3. Concise reasons (2-3 sentences)
 
-            # 2. 创建更明确的总结提示
-            summary_prompt = f"""
+            Output format only: a JSON object with the fields
+            "risk_agent": the risk expert's analysis,
+            "service_agent": the customer manager's response,
+            "decision": "APPROVED" or "REJECTED",
+            "reason": the arbiter's reasons
+
+            Fraud evidence data:
+            {{$evidence}}
+            """,
+    template_format="semantic-kernel"
+    )
+)
+
+# 结构化输出无法解析时的兜底：按原总结提示词从自由文本中给出裁决
+FRAUD_SUMMARY_TEMPLATE = KernelPromptTemplate(
+    prompt_template_config=PromptTemplateConfig(
+    template="""
             Please make a final decision based on the following expert discussions, adopt more positive opinions, and try to approve the loan as much as possible:
         
-            {formatted_discussion}
+            {{$discussion}}
         
             Decision requirements:
             1. Comprehensive risk analysis and service recommendations
@@ -227,26 +140,117 @@ class FraudEvaluator:
             Please return strictly in the following format:
             Decision: [APPROVED/REJECTED]
             Reason: [your reasons]
-            """
-            
-            self.logger.info("调用 SK 函数生成最终决策")
-            final_decision = await self.kernel.invoke(
-                self.kernel.add_function(
-                    plugin_name="DecisionServices",
-                    function_name="MakeFinalDecision",
-                    prompt_template_config=PromptTemplateConfig(
-                        template=summary_prompt,
-                        function_name="make_final_decision"
-                    )
-                ),
-                arguments=KernelArguments()
+            """,
+    template_format="semantic-kernel"
+    )
+)
+
+class FraudEvaluator:
+    def __init__(self):
+        self.logger = logging.getLogger("fraud_evaluator")
+        
+        self.kernel = sk.Kernel()
+        self.logger.info("初始化 SK Kernel")
+        
+        endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
+        api_key = os.getenv("AZURE_OPENAI_API_KEY")
+        api_version = os.getenv("AZURE_OPENAI_API_VERSION", "2024-12-01-preview")
+        self.kernel.add_service(
+            AzureChatCompletion(
+                service_id="credit_ai",
+                deployment_name=os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4o-mini"),
+                endpoint=endpoint,
+                api_key=api_key,
+                api_version=api_version,
+                async_client=get_openai_client(endpoint, api_key, api_version)
             )
+        )
+        self.logger.info("添加 AzureChatCompletion 服务到 Kernel")
+        
+        self.fraud_review = self.kernel.add_function(
+            plugin_name="FraudServices",
+            function_name="FraudReview",
+            prompt_template=FRAUD_REVIEW_TEMPLATE,
+            prompt_execution_settings=AzureChatPromptExecutionSettings(
+                service_id="credit_ai",
+                response_format={"type": "json_object"},
+                temperature=0.0
+            )
+        )
+        
+        self.fraud_summary = self.kernel.add_function(
+            plugin_name="FraudServices",
+            function_name="MakeFinalDecision",
+            prompt_template=FRAUD_SUMMARY_TEMPLATE,
+            # 只需结论 + 2~3 句理由，限制输出长度
+            prompt_execution_settings=AzureChatPromptExecutionSettings(
+                service_id="credit_ai",
+                temperature=0.0,
+                max_tokens=120
+            )
+        )
+        self.logger.info("初始化欺诈评估函数")
+    
+    async def evaluate(self, evidence_data: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            self.logger.info("开始欺诈评估")
+            # 1. 直接将证据数据转换为字符串作为提示（Foundry 返回的已是字符串，不再重复序列化）
+            evidence_str = to_prompt_text(evidence_data)
+            self.logger.debug("准备评估数据: %s", evidence_str)
             
-            self.logger.info(f"最终决策结果: {final_decision}")
+            # 结构化证据按键排序后哈希，与字段顺序无关
+            if isinstance(evidence_data, (dict, list)):
+                key_bytes = orjson.dumps(evidence_data, option=orjson.OPT_SORT_KEYS, default=str)
+            else:
+                key_bytes = evidence_str.encode("utf-8")
+            key = hashlib.sha256(key_bytes).hexdigest()
+            cached = _fraud_review_cache.get(key)
+            if cached is not None:
+                self.logger.info("命中欺诈评估缓存")
+                final_decision, formatted_discussion = cached
+                return {
+                    "status": "success",
+                    "decision": final_decision,
+                    "discussion": formatted_discussion,
+                    "timestamp": datetime.now().isoformat()
+                }
+            
+            # 2. 一次模型调用完成双方意见与裁决
+            async with llm_slot():
+                result = await self.kernel.invoke(
+                    self.fraud_review,
+                    arguments=KernelArguments(evidence=evidence_str)
+                )
+            
+            # 3. 解析结构化输出，直接得到裁决，无需再调用总结模型
+            try:
+                review = orjson.loads(str(result))
+            except ValueError:
+                review = None
+            
+            if isinstance(review, dict):
+                formatted_discussion = "\n".join([
+                    f"【risk_agent】{review.get('risk_agent', '')}",
+                    f"【service_agent】{review.get('service_agent', '')}"
+                ])
+                final_decision = f"Decision: {review.get('decision', '')}\nReason: {review.get('reason', '')}"
+            else:
+                # 输出不是有效的 JSON 时，把原始输出当作讨论记录再总结一次
+                self.logger.warning("欺诈评估输出不是有效的 JSON，改用总结模型: %s", result)
+                formatted_discussion = str(result)
+                async with llm_slot():
+                    final_decision = str(await self.kernel.invoke(
+                        self.fraud_summary,
+                        arguments=KernelArguments(discussion=formatted_discussion)
+                    ))
+            self.logger.debug("=== 完整讨论记录 ===\n%s", formatted_discussion)
+            
+            self.logger.info("最终决策结果: %s", final_decision)
+            _fraud_review_cache[key] = (final_decision, formatted_discussion)
             
             return {
                 "status": "success",
-                "decision": str(final_decision),
+                "decision": final_decision,
                 "discussion": formatted_discussion,
                 "timestamp": datetime.now().isoformat()
             }
@@ -258,12 +262,25 @@ class FraudEvaluator:
                 "timestamp": datetime.now().isoformat()
             }
 
+# 共享的欺诈评估实例（Kernel 与提示词函数只创建一次，评估本身不保存会话状态）
+_fraud_evaluator: Optional[FraudEvaluator] = None
+
+def get_fraud_evaluator() -> FraudEvaluator:
+    """获取共享的 FraudEvaluator 实例"""
+    global _fraud_evaluator
+    if _fraud_evaluator is None:
+        _fraud_evaluator = FraudEvaluator()
+    return _fraud_evaluator
+
 async def fraud_analysis_workflow(user_id: str) -> Dict[str, Any]:
     """欺诈分析工作流"""
     try:
+        # 首次调用时从 Key Vault 读取密钥
+        await load_secrets()
+
         # 初始化客户端
-        foundry_agent = FoundryIncomeAgent()
-        evaluator = FraudEvaluator()
+        foundry_client = get_foundry_client()
+        evaluator = get_fraud_evaluator()
         cosmos_client = CosmosDBClient()
         
 
@@ -272,10 +289,10 @@ async def fraud_analysis_workflow(user_id: str) -> Dict[str, Any]:
         user_name = user_info.get("name")
         if not user_name:
             raise ValueError("用户信息中缺少姓名")
-        print(f"获取到用户信息: {json.dumps(user_info, indent=2)}")
+        logger.debug("获取到用户信息: %s", user_info)
 
-        investigation_result = await foundry_agent.get_EvidenceOfFraud_blob_path(user_name)
-        print(f"获取到欺诈调查结果: {json.dumps(investigation_result, indent=2)}")
+        investigation_result = await foundry_client.invoke(FRAUD_EVIDENCE_AGENT_ID, user_name)
+        logger.debug("获取到欺诈调查结果: %s", investigation_result)
 
         # 评估欺诈风险
         result = await evaluator.evaluate(investigation_result)
@@ -0,0 +1,99 @@
+"""
+LLM 请求微批处理
+在短时间窗口内收集并发的评估请求，合并为一次模型调用，再把结果分发回各个调用方。
+"""
+
+import re
+import orjson
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional
+
+logger = logging.getLogger("llm_batching")
+
+# 收集窗口（毫秒）与单批最大请求数
+BATCH_WINDOW_MS = 25
+BATCH_SIZE = 32
+
+_CODE_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+def parse_batch_output(text: str, expected: int) -> Optional[List[str]]:
+    """解析批量调用返回的 JSON 字符串数组，格式或数量不符时返回 None"""
+    try:
+        results = orjson.loads(_CODE_FENCE.sub("", text.strip()))
+    except ValueError:
+        return None
+    if not isinstance(results, list) or len(results) != expected:
+        return None
+    return [str(r) for r in results]
+
+
+class MicroBatcher:
+    """把同一时间窗口内提交的请求合并后交给 flush 批量处理
+
+    flush 接收请求列表，返回等长、顺序一致的结果列表。
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[List[Any]], Awaitable[List[Any]]],
+        max_batch_size: int = BATCH_SIZE,
+        window_ms: int = BATCH_WINDOW_MS
+    ):
+        self._flush = flush
+        self.max_batch_size = max_batch_size
+        self.window = window_ms / 1000
+        self._loop = None
+        self._queue = None
+        self._worker = None
+        # 事件循环只弱引用任务，这里保留强引用，避免后台任务执行中被回收
+        self._tasks = set()
+
+    def _spawn(self, coro) -> asyncio.Task:
+        """创建后台任务并持有引用，任务结束后移除"""
+        task = self._loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def submit(self, item: Any) -> Any:
+        """提交一个请求并等待其结果"""
+        loop = asyncio.get_running_loop()
+        # 队列和后台任务绑定事件循环，循环变化时重新创建
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = self._spawn(self._collect())
+        future = loop.create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _collect(self):
+        """后台收集请求，窗口到期或达到批大小时发起一次批量调用"""
+        while True:
+            batch = [await self._queue.get()]
+            deadline = self._loop.time() + self.window
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # 批量调用在独立任务中执行，不阻塞下一批的收集
+            self._spawn(self._dispatch(batch))
+
+    async def _dispatch(self, batch):
+        try:
+            if len(batch) > 1:
+                logger.info("合并 %d 个请求为一次模型调用", len(batch))
+            results = await self._flush([item for item, _ in batch])
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
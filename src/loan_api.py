@@ -1,22 +1,29 @@
-from fastapi import FastAPI, HTTPException, Body, File, UploadFile, Form, Request
+from fastapi import FastAPI, HTTPException, Body, File, UploadFile, Form, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, HTMLResponse, FileResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, HTMLResponse, FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 import uvicorn
-from typing import Dict, Any, Optional, List, Union
-import json
+import aiofiles
+from typing import Dict, Any, Optional, List, Union, Tuple, TypedDict
+import re
+import orjson
 import asyncio
 import os
 import uuid
+from functools import lru_cache
 from pydantic import BaseModel
 from datetime import datetime
-from azure.storage.blob import BlobServiceClient
 from azure.core.exceptions import ResourceExistsError
-from azure.cosmos import CosmosClient, exceptions
+from azure.cosmos import exceptions
 
 # Import existing system
-from loan_application_system import LoanApplication
 from loan_application_api_adapter import LoanApplicationAdapter
+from azure_clients import close_clients, get_blob_service_client, get_cosmos_client, load_secrets, prewarm_foundry_agents, prewarm_openai_client
+from session_store import get_session_store, close_session_store
+from compliance_agent import compliance_review_stream
+from credit_agent import INCOME_AGENT_ID
+from fraud_agent import FRAUD_EVIDENCE_AGENT_ID
+from decision_agent import DECISION_AGENT_ID
 from logging_config import configure_logging
 import logging
 from dotenv import load_dotenv
@@ -28,11 +35,8 @@ logging.basicConfig(level=logging.DEBUG)
 # Configure logging
 logger = configure_logging()
 
-# Create a global instance of LoanApplication
-loan_application_instance = LoanApplication()
-
-# Define question list
-QUESTIONS = [
+# Define question list (immutable and shared by all sessions; each session only keeps a cursor)
+QUESTIONS = (
     {"field": "name", "question": "What is your name?"},
     {"field": "phone", "question": "Please provide your contact number."},
     {"field": "email", "question": "What is your email address?"},
@@ -49,7 +53,7 @@ QUESTIONS = [
     {"field": "loan_start_date", "question": "When do you wish the loan to start?"},
     #{"field": "employment_certificate", "question": "Please upload your employment certificate using the button on the right."},
     #{"field": "bank_statement", "question": "Please upload your bank statement using the button on the right."}
-]
+)
 
 # Define required fields
 REQUIRED_FIELDS = {
@@ -68,19 +72,47 @@ REQUIRED_FIELDS = {
     "property_size": "Property Size",
     "loan_start_date": "Loan Start Date"
 }
+REQUIRED_KEYS = frozenset(REQUIRED_FIELDS)
+
+# Number of chat messages kept per session (older turns are dropped)
+MAX_CHAT_HISTORY = 40
+
+# Replies that start the application / restart it after completion (whole words, case-insensitive)
+WELCOME_RE = re.compile(r"\b(yes|ok(?:ay)?|start)\b", re.I)
+RESTART_RE = re.compile(r"\b(re)?start\b", re.I)
 
 # Define upload directory
 UPLOAD_DIR = "uploads"
 
+# Chunk size used when streaming uploaded files to disk
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Number of blocks uploaded in parallel for large documents
+BLOB_UPLOAD_CONCURRENCY = 4
+
+# Blob container for uploaded application documents
+AZURE_STORAGE_CONTAINER_NAME = os.getenv('AZURE_STORAGE_CONTAINER_NAME')
+
 # Add Cosmos DB related configuration at the top of the file
-COSMOS_ENDPOINT = os.getenv('COSMOS_ENDPOINT')
-COSMOS_KEY = ""
-# COSMOS_KEY = os.getenv('COSMOS_KEY')
 COSMOS_DATABASE_NAME = os.getenv('COSMOS_DATABASE_NAME')
 COSMOS_CONTAINER_NAME = os.getenv('COSMOS_CONTAINER_NAME')
 
-# Create API application
-app = FastAPI(title="Loan Evaluation System API", description="Solvay Capital Bank Loan Evaluation System API")
+# Cosmos writes are buffered and flushed in batches: up to COSMOS_WRITE_BATCH_SIZE documents
+# or every COSMOS_WRITE_INTERVAL seconds, with at most COSMOS_WRITE_CONCURRENCY upserts in flight
+COSMOS_WRITE_BATCH_SIZE = 50
+COSMOS_WRITE_INTERVAL = 0.5
+COSMOS_WRITE_CONCURRENCY = 8
+
+# Maximum number of loan evaluations running at the same time in this worker
+MAX_CONCURRENT_EVALUATIONS = int(os.getenv("MAX_CONCURRENT_EVALUATIONS", "8"))
+_evaluation_semaphore = asyncio.Semaphore(MAX_CONCURRENT_EVALUATIONS)
+
+# Create API application (responses are serialized with orjson)
+app = FastAPI(
+    title="Loan Evaluation System API",
+    description="Solvay Capital Bank Loan Evaluation System API",
+    default_response_class=ORJSONResponse
+)
 
 # Configure CORS - Use a more permissive configuration, ensure this is the first middleware
 app.add_middleware(
@@ -123,11 +155,10 @@ async def root():
     </html>
     """
 
-# Session storage
-sessions: Dict[str, Dict[str, Any]] = {}
+# Session storage (in-process by default, shared through Redis when REDIS_URL is set)
 files: Dict[str, str] = {}
 
-class ChatMessage(BaseModel):
+class ChatMessage(TypedDict):
     role: str
     content: str
 
@@ -163,22 +194,23 @@ class LoanApplicationRequest(BaseModel):
     bank_statement: str
     user_id: str
 
-def initialize_session() -> str:
+async def initialize_session() -> Tuple[str, Dict[str, Any]]:
     """
     Initialize a new session
     
     Returns:
-        str: New session ID
+        Tuple[str, Dict[str, Any]]: New session ID and session data
     """
     session_id = str(uuid.uuid4())
-    sessions[session_id] = {
+    session = {
         "state": "welcome",
         "chat_history": [],
         "collected_data": {},
-        "question_queue": [q for q in QUESTIONS],
+        "q_idx": 0,
         "current_question": None
     }
-    return session_id
+    await get_session_store().set(session_id, session)
+    return session_id, session
 
 def get_next_question(session: Dict[str, Any]) -> Optional[Dict[str, str]]:
     """
@@ -190,11 +222,27 @@ def get_next_question(session: Dict[str, Any]) -> Optional[Dict[str, str]]:
     Returns:
         Optional[Dict[str, str]]: The next question, returns None if no more questions
     """
-    if not session["question_queue"]:
+    q_idx = session["q_idx"]
+    if q_idx >= len(QUESTIONS):
         return None
-    session["current_question"] = session["question_queue"].pop(0)
+    session["q_idx"] = q_idx + 1
+    session["current_question"] = QUESTIONS[q_idx]
     return session["current_question"]
 
+def append_chat_message(session: Dict[str, Any], role: str, content: str):
+    """
+    Append a message to the session chat history, keeping only the latest MAX_CHAT_HISTORY messages
+    
+    Args:
+        session: Session data
+        role: Message role (user / assistant)
+        content: Message content
+    """
+    history: List[ChatMessage] = session["chat_history"]
+    history.append(ChatMessage(role=role, content=content))
+    if len(history) > MAX_CHAT_HISTORY:
+        del history[:-MAX_CHAT_HISTORY]
+
 def format_data_summary(data: Dict[str, Any]) -> str:
     """
     Format collected data into a readable string
@@ -205,11 +253,14 @@ def format_data_summary(data: Dict[str, Any]) -> str:
     Returns:
         str: Formatted data summary
     """
-    summary = "Here is the information you provided:\n\n"
-    for field, label in REQUIRED_FIELDS.items():
-        value = data.get(field, "Not provided")
-        summary += f"{label}: {value}\n"
-    return summary
+    return _format_summary(tuple(str(data.get(field, "Not provided")) for field in REQUIRED_FIELDS))
+
+@lru_cache(maxsize=1024)
+def _format_summary(values: Tuple[str, ...]) -> str:
+    """Build the summary text for field values given in REQUIRED_FIELDS order (cached for repeated views)"""
+    return "Here is the information you provided:\n\n" + "".join(
+        f"{label}: {value}\n" for label, value in zip(REQUIRED_FIELDS.values(), values)
+    )
 
 def validate_required_fields(data: Dict[str, Any]) -> List[str]:
     """
@@ -221,11 +272,11 @@ def validate_required_fields(data: Dict[str, Any]) -> List[str]:
     Returns:
         List[str]: List of missing fields
     """
-    missing_fields = []
-    for field in REQUIRED_FIELDS:
-        if field not in data or not data[field]:
-            missing_fields.append(REQUIRED_FIELDS[field])
-    return missing_fields
+    missing = REQUIRED_KEYS.difference(field for field, value in data.items() if value)
+    if not missing:
+        return []
+    # Keep the labels in question order
+    return [label for field, label in REQUIRED_FIELDS.items() if field in missing]
 
 # Add a generic exception handler to ensure all error responses include CORS headers
 @app.exception_handler(Exception)
@@ -241,6 +292,33 @@ async def generic_exception_handler(request: Request, exc: Exception):
         headers={"Access-Control-Allow-Origin": "*"}
     )
     
+# Load secrets from Key Vault once at startup, then prefetch the Foundry agent definitions
+@app.on_event("startup")
+async def startup_secrets():
+    await load_secrets()
+    start_cosmos_writer()
+    await asyncio.gather(
+        prewarm_foundry_agents(
+            os.getenv("AZURE_AI_PROJECT_CONNECTION_STRING"),
+            (INCOME_AGENT_ID, FRAUD_EVIDENCE_AGENT_ID, DECISION_AGENT_ID)
+        ),
+        prewarm_openai_client(
+            os.getenv("AZURE_OPENAI_ENDPOINT"),
+            os.getenv("AZURE_OPENAI_API_KEY"),
+            os.getenv("AZURE_OPENAI_API_VERSION")
+        )
+    )
+
+# Close shared Azure clients on shutdown
+@app.on_event("shutdown")
+async def shutdown_clients():
+    global _cosmos_container, _upload_container
+    await stop_cosmos_writer()
+    await close_clients()
+    await close_session_store()
+    _cosmos_container = None
+    _upload_container = None
+
 # Health check endpoint
 @app.get("/api/health")
 async def health_check():
@@ -277,39 +355,46 @@ async def evaluate_loan(application: LoanApplicationRequest):
             "bank_statement": "ZhangSanLiuShui.png",
             "user_id": application.user_id
         }
-        # Asynchronously execute evaluation using the adapter
-        loan_application_instance.collected_data = loan_data
-        result = await LoanApplicationAdapter.evaluate_loan_async(loan_application_instance)
+        # Asynchronously execute evaluation using the adapter, bounded per worker
+        async with _evaluation_semaphore:
+            result = await LoanApplicationAdapter.evaluate_loan_async(loan_data)
         logger.info(f"Loan evaluation completed: {application.name}, status: {result['status']}")
         
-        # Save evaluation result to chat history
-        session_id = str(uuid.uuid4())
-        if "evaluation_details" in result:
-            sessions[session_id] = {
-                "evaluation_messages": result["evaluation_details"],
-                "user_messages": []
-            }
-        
         return result
     except Exception as e:
         logger.error(f"Error during evaluation process: {str(e)}", exc_info=True)
         # Use the generic exception handler
         raise
 
+# Stream the compliance review as server-sent events so the client can render it as it is generated
+@app.get("/api/loan/compliance/{user_id}/stream")
+async def stream_compliance_review(user_id: str):
+    async def event_stream():
+        try:
+            async for text in compliance_review_stream(user_id):
+                yield f"data: {orjson.dumps({'text': text}).decode()}\n\n"
+        except Exception as e:
+            logger.error(f"Compliance review stream error: {str(e)}", exc_info=True)
+            yield f"event: error\ndata: {orjson.dumps({'message': str(e)}).decode()}\n\n"
+        yield "event: done\ndata: {}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 # Chat endpoint - Use custom JSONResponse handler
 @app.post("/api/loan/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest) -> ChatResponse:
+async def chat(request: ChatRequest, verbose: bool = False) -> ChatResponse:
     try:
-        # Get or create session ID
-        session_id = request.session_id or initialize_session()
-        if session_id not in sessions:
-            session_id = initialize_session()
+        # Get or create session
+        session_store = get_session_store()
+        session_id = request.session_id
+        session = await session_store.get(session_id) if session_id else None
+        if session is None:
+            session_id, session = await initialize_session()
         
-        session = sessions[session_id]
         response_message = ""
         
         # Log user message
-        session["chat_history"].append(ChatMessage(role="user", content=request.message))
+        append_chat_message(session, "user", request.message)
         
         # Handle form submission
         if request.is_form_submit and request.form_data:
@@ -328,7 +413,7 @@ async def chat(request: ChatRequest) -> ChatResponse:
         # Handle based on session state
         if session["state"] == "welcome":
             response_message = "Welcome to the loan evaluation system! I will assist you in completing the loan application. Are you ready to start?"
-            if "yes" in request.message or "okay" in request.message or "start" in request.message:
+            if WELCOME_RE.search(request.message):
                 session["state"] = "collecting"
                 next_question = get_next_question(session)
                 if next_question:
@@ -368,15 +453,11 @@ async def chat(request: ChatRequest) -> ChatResponse:
             # Write to Cosmos DB
             # Create document
             document = setCosmosDB(session["collected_data"], session_id)
-            # Write document to Cosmos DB
-            await write_to_cosmos_db(document)
+            # Queue document for the batched Cosmos DB writer
+            await enqueue_cosmos_write(document)
             
             # Evaluate loan application using backend system
-            # loan_application = LoanApplication()#session["collected_data"]
-            loan_application_instance.collected_data = session["collected_data"]
-            adapter = LoanApplicationAdapter()
-            # Use static method  
-            # evaluation_result = await LoanApplicationAdapter.evaluate_loan_async(loan_application_instance)
+            # evaluation_result = await LoanApplicationAdapter.evaluate_loan_async(session["collected_data"])
             
             # response_message = f"Evaluation result:\n{evaluation_result}"
             # session["state"] = "completed"
@@ -385,20 +466,21 @@ async def chat(request: ChatRequest) -> ChatResponse:
         
         if session["state"] == "completed":
             response_message = response_message + "\n\n Your loan application has been processed. If you need to reapply, please say 'restart'."
-            if "restart" in request.message or "start" in request.message:
-                session_id = initialize_session()
-                session = sessions[session_id]
+            if RESTART_RE.search(request.message):
+                session_id, session = await initialize_session()
                 response_message = "Welcome to the loan evaluation system! I will assist you in completing the loan application. Are you ready to start?"
         
         # Log assistant response
-        session["chat_history"].append(ChatMessage(role="assistant", content=response_message))
+        append_chat_message(session, "assistant", response_message)
+        await session_store.set(session_id, session)
         
         return ChatResponse(
             session_id=session_id,
             message=response_message,
             state=session["state"],
             collected_data=session["collected_data"],
-            conversation_state=session
+            # Only the state is returned by default, the full session (history included) on ?verbose=1
+            conversation_state=session if verbose else {"state": session["state"]}
         )
     
     except Exception as e:
@@ -411,17 +493,19 @@ async def upload_file(user_id: str, file: UploadFile = File(...)):
     try:
         # Create user directory
         user_dir = os.path.join(UPLOAD_DIR, user_id)
-        os.makedirs(user_dir, exist_ok=True)
+        await asyncio.to_thread(os.makedirs, user_dir, exist_ok=True)
         
-        # Save file
+        # Save file chunk by chunk without blocking the event loop
         file_path = os.path.join(user_dir, file.filename)
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+        async with aiofiles.open(file_path, "wb") as f:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                await f.write(chunk)
         
         # Update session state
-        if user_id in sessions:
-            sessions[user_id]["files_uploaded"] = True
+        session = await get_session_store().get(user_id)
+        if session is not None:
+            session["files_uploaded"] = True
+            await get_session_store().set(user_id, session)
         
         return {"message": "File uploaded successfully", "file_path": file_path}
     
@@ -432,101 +516,96 @@ async def upload_file(user_id: str, file: UploadFile = File(...)):
 # Get session state
 @app.get("/api/loan/session/{session_id}")
 async def get_session(session_id: str):
-    if session_id not in sessions:
+    session = await get_session_store().get(session_id)
+    if session is None:
         raise HTTPException(status_code=404, detail="Session does not exist")
-    return sessions[session_id]
+    return session
 
 # Get chat history
 @app.get("/api/loan/chat-history/{session_id}")
 async def get_chat_history(session_id: str):
-    if session_id not in sessions:
+    session = await get_session_store().get(session_id)
+    if session is None:
         raise HTTPException(status_code=404, detail="Chat history does not exist")
-    return sessions[session_id]["chat_history"]
+    return session["chat_history"]
 
-async def async_initiate_chat(data_collector, user_proxy, message):
-    # Use asyncio.to_thread to convert synchronous operation to asynchronous
-    try:
-        chat_result = await asyncio.to_thread(
-            data_collector.initiate_chat,
-            user_proxy,
-            message=message,
-            is_termination=lambda x: "DATA_COLLECTION_COMPLETE" in x.get("content", "")
-        )
-        return chat_result
-    except Exception as e:
-        logger.error(f"Asynchronous chat error: {str(e)}")
-        return None
+# Container client for uploaded documents, the container is created on first use only
+_upload_container = None
+_upload_container_lock = asyncio.Lock()
+
+async def get_upload_container():
+    """
+    Get the shared upload container client, creating the container once if it does not exist
     
+    The connection string is read on first use so that values loaded from Key Vault at startup are picked up.
+    """
+    global _upload_container
+    if _upload_container is not None:
+        return _upload_container
+    async with _upload_container_lock:
+        if _upload_container is None:
+            # Get Azure storage connection string
+            connect_str = os.getenv('AZURE_STORAGE_CONNECTION_STRING')
+            if not connect_str:
+                raise ValueError("Azure Storage connection string not found")
+
+            # Get the shared async BlobServiceClient (pooled connections)
+            container_client = get_blob_service_client(connect_str).get_container_client(AZURE_STORAGE_CONTAINER_NAME)
+            try:
+                await container_client.create_container()
+            except ResourceExistsError:
+                pass
+            _upload_container = container_client
+    return _upload_container
+
 # File upload endpoint (optional)
 @app.post("/api/loan/upload-documents")
 async def upload_documents(
     user_id: str = Form(...),
     employment_certificate: UploadFile = File(None),
-    bank_statement: UploadFile = File(None)
+    bank_statement: UploadFile = File(None),
+    container_client = Depends(get_upload_container)
 ):
     try:
         logger.info(f"Received document upload request: User ID {user_id}")
-        
-        # Get Azure storage connection string
-        connect_str = os.getenv('AZURE_STORAGE_CONNECTION_STRING')
-        if not connect_str:
-            raise ValueError("Azure Storage connection string not found")
-
-        # Create BlobServiceClient instance
-        blob_service_client = BlobServiceClient.from_connection_string(connect_str)
-        
-        # Create container name (if it does not exist)
-        container_name = os.getenv('AZURE_STORAGE_CONTAINER_NAME')
-        try:
-            container_client = blob_service_client.create_container(container_name)
-        except ResourceExistsError:
-            container_client = blob_service_client.get_container_client(container_name)
 
-        result = {"uploaded_files": []}
         current_time = datetime.now().strftime("%Y%m%d_%H%M%S")
 
-        # Upload employment certificate
-        if employment_certificate:
+        async def upload_one(kind: str, upload: UploadFile) -> Dict[str, Any]:
             # Generate a unique blob name
-            blob_name = f"employment_certificate_{current_time}_{employment_certificate.filename}"
+            blob_name = f"{kind}_{current_time}_{upload.filename}"
             blob_client = container_client.get_blob_client(blob_name)
             
-            # Read file content and upload
-            content = await employment_certificate.read()
-            blob_client.upload_blob(content, overwrite=True)
+            # Stream the spooled upload file to Blob storage without buffering it in memory
+            await blob_client.upload_blob(
+                upload.file,
+                length=upload.size,
+                overwrite=True,
+                max_concurrency=BLOB_UPLOAD_CONCURRENCY
+            )
             
-            result["uploaded_files"].append({
-                "type": "employment_certificate",
-                "filename": employment_certificate.filename,
+            files[kind] = blob_name
+            logger.info(f"Uploaded {kind} to Azure Blob: {blob_name}")
+            return {
+                "type": kind,
+                "filename": upload.filename,
                 "blob_url": blob_client.url
-            })
-            files["employment_certificate"] = blob_name
-            logger.info(f"Uploaded employment certificate to Azure Blob: {blob_name}")
+            }
 
-        # Upload bank statement
-        if bank_statement:
-            # Generate a unique blob name
-            blob_name = f"bank_statement_{current_time}_{bank_statement.filename}"
-            blob_client = container_client.get_blob_client(blob_name)
-            
-            # Read file content and upload
-            content = await bank_statement.read()
-            blob_client.upload_blob(content, overwrite=True)
-            
-            result["uploaded_files"].append({
-                "type": "bank_statement",
-                "filename": bank_statement.filename,
-                "blob_url": blob_client.url
-            })
-            files["bank_statement"] = blob_name
-            logger.info(f"Uploaded bank statement to Azure Blob: {blob_name}")
+        # Upload employment certificate and bank statement concurrently
+        uploads = [
+            upload_one(kind, upload)
+            for kind, upload in (("employment_certificate", employment_certificate), ("bank_statement", bank_statement))
+            if upload
+        ]
+        result = {"uploaded_files": list(await asyncio.gather(*uploads))}
 
         return result
     except Exception as e:
         logger.error(f"File upload error: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"File upload error: {str(e)}")
 
-def setCosmosDB(data: Dict[str,Any],session_id:str) -> str:
+def setCosmosDB(data: Dict[str,Any],session_id:str) -> Dict[str, Any]:
  
     new_data = data.copy()
     # Add additional fields TODO
@@ -545,38 +624,146 @@ def setCosmosDB(data: Dict[str,Any],session_id:str) -> str:
     new_data["submissionDate"] = datetime.utcnow().isoformat()  # Example category
     new_data["age"] = int(data.get("age")) if data.get("age") is not None else None  # Convert to int # Example category
     
-    # Convert data dictionary to JSON string
-    json_data = json.dumps(new_data, ensure_ascii=False)  # ensure_ascii=False to support Chinese characters
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("COSMOS DB: %s", orjson.dumps(new_data, default=str).decode())
+    return new_data
+
+# Container client for application documents, created on first write
+_cosmos_container = None
+
+def get_cosmos_container():
+    """
+    Get the shared Cosmos container client (pooled, session consistency)
     
-    logger.info(f"COSMOS DB: {json_data}")
-    return json_data
+    Uses COSMOS_CONNECTION_STRING when set, otherwise COSMOS_ENDPOINT with COSMOS_KEY or managed identity.
+    """
+    global _cosmos_container
+    if _cosmos_container is None:
+        cosmos_client = get_cosmos_client(os.getenv("COSMOS_CONNECTION_STRING"))
+        database = cosmos_client.get_database_client(COSMOS_DATABASE_NAME)
+        _cosmos_container = database.get_container_client(COSMOS_CONTAINER_NAME)
+    return _cosmos_container
 
-async def write_to_cosmos_db(document: str):
+async def write_to_cosmos_db(document: Dict[str, Any]):
     """
     Write document to Cosmos DB
     
     Args:
-        document: JSON string to write
+        document: Document to write
     """
     try:
-        cosmos_client = CosmosClient(COSMOS_ENDPOINT, COSMOS_KEY)
-        database = cosmos_client.get_database_client(COSMOS_DATABASE_NAME)
-        container = database.get_container_client(COSMOS_CONTAINER_NAME)
+        container = get_cosmos_container()
 
         # Write document to Cosmos DB
-        container.upsert_item(json.loads(document))  # Convert JSON string to dictionary
-        logger.info(f"Document information written to Cosmos DB: {document}")
+        await container.upsert_item(document)
+        logger.info("Document information written to Cosmos DB: %s", document["id"])
 
     except exceptions.CosmosHttpResponseError as e:
         logger.error(f"Failed to write to Cosmos DB: {str(e)}", exc_info=True)
 
+# Pending Cosmos writes and the background task that flushes them
+_cosmos_write_queue: Optional[asyncio.Queue] = None
+_cosmos_writer_task: Optional[asyncio.Task] = None
+
+async def flush_cosmos_writes(documents: List[Dict[str, Any]]):
+    """
+    Write a batch of documents to Cosmos DB concurrently
+    
+    Documents are keyed by id, so only the latest version of each document in the batch is written.
+    
+    Args:
+        documents: Documents to write
+    """
+    latest = {document["id"]: document for document in documents}
+    semaphore = asyncio.Semaphore(COSMOS_WRITE_CONCURRENCY)
+
+    async def write_one(document: Dict[str, Any]):
+        async with semaphore:
+            await write_to_cosmos_db(document)
+
+    results = await asyncio.gather(*(write_one(d) for d in latest.values()), return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(f"Failed to write to Cosmos DB: {str(result)}")
+
+async def _cosmos_writer():
+    """Collect queued documents and flush them when the batch is full or the interval has elapsed"""
+    loop = asyncio.get_running_loop()
+    stopping = False
+    while not stopping:
+        batch = []
+        document = await _cosmos_write_queue.get()
+        if document is None:
+            break
+        batch.append(document)
+        deadline = loop.time() + COSMOS_WRITE_INTERVAL
+        while len(batch) < COSMOS_WRITE_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                document = await asyncio.wait_for(_cosmos_write_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if document is None:
+                stopping = True
+                break
+            batch.append(document)
+        await flush_cosmos_writes(batch)
+
+def start_cosmos_writer():
+    """Start the background Cosmos writer (called on startup)"""
+    global _cosmos_write_queue, _cosmos_writer_task
+    _cosmos_write_queue = asyncio.Queue()
+    _cosmos_writer_task = asyncio.create_task(_cosmos_writer())
+
+async def stop_cosmos_writer():
+    """Flush pending writes and stop the background Cosmos writer (called on shutdown)"""
+    global _cosmos_write_queue, _cosmos_writer_task
+    if _cosmos_writer_task is not None:
+        await _cosmos_write_queue.put(None)
+        await _cosmos_writer_task
+    _cosmos_write_queue = None
+    _cosmos_writer_task = None
+
+async def enqueue_cosmos_write(document: Dict[str, Any]):
+    """
+    Queue a document for the batched Cosmos writer, writing it directly if the writer is not running
+    
+    Args:
+        document: Document to write
+    """
+    if _cosmos_write_queue is None:
+        await write_to_cosmos_db(document)
+        return
+    await _cosmos_write_queue.put(document)
+
 # Start server
 if __name__ == "__main__":
     # Ensure upload directory exists
-    os.makedirs("uploads", exist_ok=True)
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
     os.makedirs("logs", exist_ok=True)
     
     logger.info("=== Solvay Capital Bank Loan Evaluation API Service Started ===")
     
-    # Start service
-    uvicorn.run("loan_api:app", host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
+    # Start service: uvloop/httptools when installed, WEB_CONCURRENCY workers (2 * cores + 1 by default).
+    # Set UVICORN_RELOAD=true for local development (single worker with auto reload).
+    # Without REDIS_URL chat sessions live in process memory, so only a single worker is started.
+    reload = os.getenv("UVICORN_RELOAD", "").lower() == "true"
+    if reload:
+        workers = 1
+    elif not os.getenv("REDIS_URL"):
+        workers = 1
+        if int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+            logger.warning("REDIS_URL is not set: ignoring WEB_CONCURRENCY and starting a single worker so chat sessions are not split across processes")
+    else:
+        workers = int(os.getenv("WEB_CONCURRENCY", (os.cpu_count() or 1) * 2 + 1))
+    uvicorn.run(
+        "loan_api:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="auto",
+        http="auto",
+        workers=workers,
+        reload=reload
+    ) 
\ No newline at end of file
@@ -1,18 +1,27 @@
 import os
 import sys
+import re
 import json
+import hashlib
+import orjson
 import logging
+import logging.handlers
+import queue
+import atexit
+import threading
 import asyncio
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 from dotenv import load_dotenv
+from cachetools import TTLCache
 import openai
 import autogen
-from concurrent.futures import ThreadPoolExecutor
-from credit_agent import CreditAnalysisAgent, credit_analysis_workflow  # 导入CreditAnalysisAgent和credit_analysis_workflow
-from fraud_agent import FoundryIncomeAgent, fraud_analysis_workflow  # 导入fraud_analysis_workflow
-from decision_agent import LoanDecisionAgent  # 导入LoanDecisionAgent
+from credit_agent import CreditAnalysisAgent, credit_analysis_workflow, get_credit_evaluator, INCOME_AGENT_ID  # 导入CreditAnalysisAgent和credit_analysis_workflow
+from fraud_agent import fraud_analysis_workflow, get_fraud_evaluator, FRAUD_EVIDENCE_AGENT_ID  # 导入fraud_analysis_workflow
+from decision_agent import get_loan_decision_agent, DECISION_AGENT_ID  # 导入共享的LoanDecisionAgent
 from datetime import datetime
-from compliance_agent import ComplianceReview, compliance_review_workflow
+from compliance_agent import ComplianceReview, compliance_review_workflow, get_compliance_review, is_compliant
+from azure_clients import close_clients, load_secrets, prewarm_foundry_agents, prewarm_openai_client
+from prompt_utils import to_prompt_text
 import uuid
 import argparse
 import io
@@ -23,8 +32,7 @@ sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
 
 # 创建日志目录
 log_dir = "logs"
-if not os.path.exists(log_dir):
-    os.makedirs(log_dir)
+os.makedirs(log_dir, exist_ok=True)
 
 # 生成日志文件名
 log_filename = os.path.join(log_dir, f"loan_application_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
@@ -50,6 +58,47 @@ logging.getLogger('docker').setLevel(logging.WARNING)
 # 获取主应用程序的日志记录器
 logger = logging.getLogger('loan_application')
 
+# 评估实例日志：各实例只把记录放入队列，由单个监听线程写入文件，事件循环中不做阻塞磁盘写入
+# 所有实例共用同一个记录器，实例 ID 通过 LoggerAdapter 附加到每条记录上，不为每个实例注册新的记录器
+_eval_logger = logging.getLogger('loan_application.evaluation')
+_eval_log_queue: queue.Queue = queue.Queue(-1)
+_eval_log_listener: Optional[logging.handlers.QueueListener] = None
+_eval_log_lock = threading.Lock()
+
+
+def _start_eval_log_listener():
+    """启动评估日志监听线程（进程内只启动一次）"""
+    global _eval_log_listener
+    with _eval_log_lock:
+        if _eval_log_listener is not None:
+            return
+        eval_log_filename = os.path.join(log_dir, f"loan_evaluations_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
+        file_handler = logging.FileHandler(eval_log_filename, encoding='utf-8')
+        file_handler.setLevel(logging.INFO)
+        # 所有实例写入同一文件，每条记录带有实例 ID
+        file_handler.setFormatter(logging.Formatter('%(asctime)s - %(instance_id)s - %(levelname)s - %(message)s'))
+        _eval_log_listener = logging.handlers.QueueListener(
+            _eval_log_queue, file_handler, respect_handler_level=True
+        )
+        _eval_log_listener.start()
+        atexit.register(_stop_eval_log_listener)
+
+        _eval_logger.setLevel(logging.INFO)
+        _eval_logger.addHandler(logging.handlers.QueueHandler(_eval_log_queue))
+        _eval_logger.propagate = False
+
+
+def _stop_eval_log_listener():
+    """写完队列中剩余的日志并关闭文件（进程退出时调用）"""
+    global _eval_log_listener
+    with _eval_log_lock:
+        if _eval_log_listener is None:
+            return
+        _eval_log_listener.stop()
+        for handler in _eval_log_listener.handlers:
+            handler.close()
+        _eval_log_listener = None
+
 # 加载环境变量
 load_dotenv()
 
@@ -70,13 +119,66 @@ config_list = [
     }
 ]
 
-# 定义llm_config
-llm_config = {
+# 数据收集agent的模型配置（固定不变，所有实例共用）
+DATA_COLLECTOR_LLM_CONFIG = {
     "config_list": config_list,
-    "temperature": 0.7,
-    "functions": []  # 移除预定义的函数列表，改为在注册时动态添加
+    "functions": []
 }
 
+# "收集的数据摘要:" 之后、结束标记或"是否同意"之前的数据段，一次扫描定位
+_SECTION_RE = re.compile(r"收集的数据摘要:(.*?)(?:DATA_COLLECTION_COMPLETE|是否同意|\Z)", re.DOTALL)
+# 数据摘要中的 "- 字段: 值" 行
+_FIELD_RE = re.compile(r"^\s*-\s+([^:\n]+?)\s*:\s*(.*?)\s*$", re.MULTILINE)
+
+# 提前决策：信用 A 级、欺诈审查通过且合规审查给出结构化的合规结论时结论已确定，直接给出批准结果，不再调用决策模型
+# 合规只认审查结论第一行的 "Compliance: COMPLIANT"（见 compliance_agent.is_compliant），不解析自由文本
+_CREDIT_GRADE_A_RE = re.compile(r"credit grade is A\b")
+_FRAUD_APPROVED_RE = re.compile(r"Decision:\s*APPROVED\b", re.IGNORECASE)
+APPROVAL_TEMPLATE = (
+    "Decision: APPROVED\n"
+    "Reason: The applicant has credit grade A, the fraud review approved the application "
+    "and the contract is compliant with the bank's loan policy.\n"
+    "Compliance review: {compliance}"
+)
+
+def _is_clean_application(credit_result: Any, fraud_result: Any, compliance_result: Any) -> bool:
+    """信用、欺诈、合规结论都无风险时返回 True"""
+    if not all(_is_success(r) for r in (credit_result, fraud_result, compliance_result)):
+        return False
+    return bool(
+        _CREDIT_GRADE_A_RE.search(str(credit_result.get("assessment", "")))
+        and _FRAUD_APPROVED_RE.search(str(fraud_result.get("decision", "")))
+        and is_compliant(str(compliance_result.get("assessment", "")))
+    )
+
+# 专家分析结果缓存：申请数据（含文件名、用户ID）不变时，重试评估直接复用信用、欺诈、合规结果
+EXPERT_RESULTS_TTL = 3600
+_expert_results_cache = TTLCache(maxsize=256, ttl=EXPERT_RESULTS_TTL)
+
+# 决策结果缓存：三项专家结果相同时直接复用决策文本，不再重复调用决策模型
+_decision_cache = TTLCache(maxsize=256, ttl=EXPERT_RESULTS_TTL)
+
+def _stable_json(data: Dict[str, Any]) -> bytes:
+    """键排序的紧凑 JSON，内容相同则字节相同"""
+    return orjson.dumps(data, default=str, option=orjson.OPT_SORT_KEYS)
+
+def _cache_key(payload: bytes) -> str:
+    """根据序列化后的内容生成缓存键"""
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+def _is_success(result: Any) -> bool:
+    return isinstance(result, dict) and result.get("status") != "error"
+
+def _is_cacheable_decision(result: Any) -> bool:
+    """决策成功且文本完整时才写入决策缓存（决策代理调用失败时返回以 [ERROR 开头的文本）"""
+    if not isinstance(result, dict) or result.get("status") != "success":
+        return False
+    text = str(result.get("decision_result") or "").strip()
+    return bool(text) and not text.startswith("[ERROR")
+
+# 批量评估时同时进行的申请数（模型调用另受 llm_slot 全局并发限制）
+BATCH_EVALUATION_CONCURRENCY = int(os.getenv("BATCH_EVALUATION_CONCURRENCY", "4"))
+
 # 配置Azure存储
 azure_storage_config = {
     "connection_string": os.getenv("AZURE_STORAGE_CONNECTION_STRING"),
@@ -94,6 +196,12 @@ cosmos_config = {
     "chat_container_name": os.getenv("COSMOS_CHAT_CONTAINER_NAME")
 }
 
+class AsyncConsoleUserProxy(autogen.UserProxyAgent):
+    """在线程中读取控制台输入，等待申请人输入期间事件循环可以继续执行其他任务"""
+
+    async def a_get_human_input(self, prompt: str) -> str:
+        return await asyncio.to_thread(self.get_human_input, prompt)
+
 class LoanApplication:
     def __init__(self):
         """初始化贷款申请系统"""
@@ -105,9 +213,11 @@ class LoanApplication:
         self.fraud_result = None
         self.compliance_result = None
         self.decision_result = None
+        # 各专家的分析结果（API 适配器返回给调用方）
+        self.expert_results: Dict[str, Any] = {}
         
-        # 初始化决策代理
-        self.decision_agent = LoanDecisionAgent()
+        # 决策代理（所有申请共享同一实例）
+        self.decision_agent = get_loan_decision_agent()
         
         # 初始化会话和连接器列表
         self._sessions = []
@@ -136,33 +246,21 @@ class LoanApplication:
         try:
             print("\n=== Data Collection Phase ===")
             
-            # 创建数据收集agent
-            data_collector = autogen.AssistantAgent(
-                name="DataCollector",
-                system_message="""你是数据收集专家，负责:
-                    1. 收集贷款申请所需的所有信息
-                    2. 确保数据的完整性和准确性
-                    3. 验证数据的有效性
-                    发言用英文""",
-                llm_config={
-                    "config_list": config_list,
-                    "functions": []
-                }
-            )
+            # 先开始预热评估阶段用到的客户端和 Agent，与代理创建及申请人输入并行
+            prewarm_task = asyncio.create_task(self._prewarm_experts())
             
-            # 创建用户代理
-            user_proxy = autogen.UserProxyAgent(
-                name="User",
-                system_message="你代表贷款申请人，负责提供申请所需的信息。",
-                human_input_mode="ALWAYS",
-                code_execution_config=False
+            # 数据收集agent与用户代理互不依赖，在线程中并发创建，不阻塞事件循环
+            data_collector, user_proxy = await asyncio.gather(
+                asyncio.to_thread(self._build_data_collector),
+                asyncio.to_thread(self._build_user_proxy)
             )
             
             # 启动数据收集对话
-            chat_result = await user_proxy.initiate_chat(
+            chat_result = await user_proxy.a_initiate_chat(
                 data_collector,
                 message="请帮助我收集贷款申请所需的信息。"
             )
+            await prewarm_task
             
             # # 提取收集到的数据
             # for message in chat_result.chat_history:
@@ -179,35 +277,56 @@ class LoanApplication:
             logging.error(f"数据收集过程出错: {str(e)}")
             return False
     
+    @staticmethod
+    def _build_data_collector() -> autogen.AssistantAgent:
+        """创建数据收集agent"""
+        return autogen.AssistantAgent(
+            name="DataCollector",
+            system_message="""你是数据收集专家，负责:
+                1. 收集贷款申请所需的所有信息
+                2. 确保数据的完整性和准确性
+                3. 验证数据的有效性
+                发言用英文""",
+            llm_config=DATA_COLLECTOR_LLM_CONFIG
+        )
+
+    @staticmethod
+    def _build_user_proxy() -> "AsyncConsoleUserProxy":
+        """创建用户代理"""
+        return AsyncConsoleUserProxy(
+            name="User",
+            system_message="你代表贷款申请人，负责提供申请所需的信息。",
+            human_input_mode="ALWAYS",
+            code_execution_config=False
+        )
+
+    async def _prewarm_experts(self):
+        """创建各专家的共享实例、获取 Foundry Agent 定义并预热 Azure OpenAI 连接"""
+        try:
+            get_credit_evaluator()
+            get_fraud_evaluator()
+            get_compliance_review()
+        except Exception as e:
+            self.logger.warning(f"预热专家实例失败: {str(e)}")
+        await asyncio.gather(
+            prewarm_foundry_agents(
+                os.getenv("AZURE_AI_PROJECT_CONNECTION_STRING"),
+                (INCOME_AGENT_ID, FRAUD_EVIDENCE_AGENT_ID, DECISION_AGENT_ID)
+            ),
+            prewarm_openai_client(
+                os.getenv("AZURE_OPENAI_ENDPOINT"),
+                os.getenv("AZURE_OPENAI_API_KEY"),
+                os.getenv("AZURE_OPENAI_API_VERSION")
+            )
+        )
+
     def parse_collected_data(self, summary):
         """从agent的最终摘要中提取结构化数据"""
-        # 提取"收集的数据摘要:"部分
-        if "收集的数据摘要:" in summary:
-            # 从收集的数据摘要:开始截取
-            data_section = summary.split("收集的数据摘要:")[1]
-            
-            # 如果有DATA_COLLECTION_COMPLETE标记，就截止到该标记
-            if "DATA_COLLECTION_COMPLETE" in data_section:
-                data_section = data_section.split("DATA_COLLECTION_COMPLETE")[0]
-            
-            # 如果有"是否同意"类型的文本，也截止到此
-            if "是否同意" in data_section:
-                data_section = data_section.split("是否同意")[0]
-                
-            data_section = data_section.strip()
-            
-            # 将数据解析到字典中
-            data_dict = {}
-            for line in data_section.split("\n"):
-                line = line.strip()
-                if line.startswith("- "):
-                    try:
-                        key, value = line[2:].split(":", 1)
-                        data_dict[key.strip()] = value.strip()
-                    except ValueError:
-                        continue
-            
-            return data_dict
+        # 提取"收集的数据摘要:"部分，截止到DATA_COLLECTION_COMPLETE标记以及"是否同意"类型的文本
+        match = _SECTION_RE.search(summary)
+        if match:
+            # 将 "- 字段: 值" 行解析到字典中
+            return dict(_FIELD_RE.findall(match.group(1)))
         else:
             # 如果格式不符合预期则使用备用方案
             return {"summary": summary}
@@ -222,126 +341,62 @@ class LoanApplication:
                 self.collected_data = test_data
                 self.logger.info("使用测试数据进行评估")
             
-            # 创建专家代理
-            agents = [
-                DecisionAgent(
-                    name="DecisionAgent",
-                    llm_config=llm_config
-                ),
-                CreditExpert(
-                    name="CreditExpert", 
-                    llm_config=llm_config
-                ),
-                FraudExpert(
-                    name="FraudExpert", 
-                    llm_config=llm_config
-                ),
-                ComplianceExpert(
-                    name="ComplianceExpert", 
-                    llm_config=llm_config
-                )
-            ]
-            self.logger.info("专家代理创建完成")
-            
-            # 为每个代理注册函数
-            for agent in agents:
-                register_functions(agent)
-            
-            # 创建用户代理
-            user_proxy = autogen.UserProxyAgent(
-                name="user_proxy",
-                human_input_mode="NEVER",
-                max_consecutive_auto_reply=10,
-                is_termination_msg=lambda x: "EVALUATION_COMPLETE" in x.get("content", ""),
-                code_execution_config={"work_dir": "workspace"},
-                llm_config=llm_config,
-                system_message="""你是一个贷款申请人的代理。你的职责是：
-                1. 提供申请人的详细信息
-                2. 回答评估过程中的问题
-                3. 配合完成整个评估流程
-                4. 确保所有必要信息都已提供"""
-            )
-            
-            # 创建群组聊天
-            groupchat = autogen.GroupChat(
-                agents=[user_proxy] + agents,
-                messages=[],
-                max_round=15
-            )
-            
-            # 创建群组聊天管理器
-            chat_manager = autogen.GroupChatManager(
-                groupchat=groupchat,
-                llm_config=llm_config
-            )
-            
             # 获取评估数据
             evaluation_data = await self.get_evaluation_data()
             
-            # 执行信用分析
-            credit_result = await self.run_credit_analysis(
-                certificate_file=evaluation_data['证明文件']['工作证明'],
-                bank_statement_file=evaluation_data['证明文件']['银行流水']
-            )
-            
-            # 执行欺诈分析
-            fraud_result = await self.run_fraud_analysis(
-                evaluation_data['证明文件']['用户ID']
-            )
-            
-            # 执行合规分析
-            compliance_result = await self.run_compliance_analysis(
-                evaluation_data['证明文件']['用户ID']
-            )
-
-            # 执行决策分析
-            decision_result = await self.run_decision_analysis(
-                evaluation_data['证明文件']['用户ID']
-            )
-            
-            # 启动群聊评估并获取结果
-            self.logger.info("开始群组聊天评估")
-            chat_result = await chat_manager.a_initiate_chat(
-                agents[1],  # credit_expert
-                message=f"""
+            cache_key = _cache_key(_stable_json(self.collected_data))
+            cached = _expert_results_cache.get(cache_key)
+            if cached is not None:
+                self.logger.info("使用缓存的专家分析结果")
+                credit_result, fraud_result, compliance_result = cached
+                self.credit_result, self.fraud_result, self.compliance_result = cached
+            else:
+                # 信用、欺诈、合规分析的输入互不依赖，并发执行（各方法内部已捕获异常）
+                credit_result, fraud_result, compliance_result = await asyncio.gather(
+                    self.run_credit_analysis(
+                        certificate_file=evaluation_data['证明文件']['工作证明'],
+                        bank_statement_file=evaluation_data['证明文件']['银行流水']
+                    ),
+                    self.run_fraud_analysis(
+                        evaluation_data['证明文件']['用户ID']
+                    ),
+                    self.run_compliance_analysis(
+                        evaluation_data['证明文件']['用户ID']
+                    )
+                )
+                # 只缓存全部成功的结果，失败的分析在重试时重新执行
+                if all(_is_success(r) for r in (credit_result, fraud_result, compliance_result)):
+                    _expert_results_cache[cache_key] = (credit_result, fraud_result, compliance_result)
+
+            if _is_clean_application(credit_result, fraud_result, compliance_result):
+                # 无风险申请直接批准，省去决策模型调用
+                self.logger.info("信用、欺诈、合规均无风险，直接批准")
+                decision_result = {
+                    "status": "success",
+                    "decision_result": APPROVAL_TEMPLATE.format(compliance=compliance_result["assessment"]),
+                    "timestamp": datetime.now().isoformat()
+                }
+                self.decision_result = decision_result
+            else:
+                # 执行决策分析
+                decision_result = await self.run_decision_analysis(
+                    evaluation_data['证明文件']['用户ID']
+                )
+            self.expert_results = {
+                "credit": credit_result,
+                "fraud": fraud_result,
+                "compliance": compliance_result,
+                "decision": decision_result
+            }
             
-请评估以下贷款申请：
-
-申请人信息：
-{json.dumps(evaluation_data['申请人信息'], ensure_ascii=False, indent=2)}
-
-工作信息：
-{json.dumps(evaluation_data['工作信息'], ensure_ascii=False, indent=2)}
-
-贷款信息：
-{json.dumps(evaluation_data['贷款信息'], ensure_ascii=False, indent=2)}
-
-证明文件：
-{json.dumps(evaluation_data['证明文件'], ensure_ascii=False, indent=2)}
-
-信用分析结果：
-{json.dumps(credit_result, ensure_ascii=False, indent=2)}
-
-欺诈分析结果：
-{json.dumps(fraud_result, ensure_ascii=False, indent=2)}
-
-合规分析结果：
-{json.dumps(compliance_result, ensure_ascii=False, indent=2)}
-
-决策结果：
-{json.dumps(decision_result, ensure_ascii=False, indent=2)}
-
-请开始评估。
-
-"""
-            )
-            self.logger.info(f"群组聊天完成，聊天历史长度: {len(chat_result.chat_history) if chat_result and hasattr(chat_result, 'chat_history') else 0}")
+            # 各专家结论直接作为评估消息，不再经过群聊轮流发言
+            agent_messages = [
+                {"role": "CreditExpert", "content": to_prompt_text(credit_result)},
+                {"role": "FraudExpert", "content": to_prompt_text(fraud_result)},
+                {"role": "ComplianceExpert", "content": to_prompt_text(compliance_result)},
+                {"role": "DecisionAgent", "content": to_prompt_text(decision_result.get("decision_result", decision_result))}
+            ]
 
-            # 收集agent消息
-            self.logger.info("开始收集agent消息")
-            agent_messages = self.collect_expert_messages(chat_result.chat_history)
-            self.logger.info(f"收集到 {len(agent_messages)} 条agent消息")
-            
             # 构建评估结果
             evaluation_result = {
                 "status": "completed",
@@ -357,23 +412,41 @@ class LoanApplication:
                     session["chat_history"] = []
                     self.logger.info("创建新的chat_history列表")
                 
-                for msg in evaluation_result['agent_messages']:
-                    session["chat_history"].append({
-                        "role": msg['name'],
-                        "content": msg['content']
-                    })
+                session["chat_history"].extend(evaluation_result['agent_messages'])
                 self.logger.info(f"会话存储完成，当前chat_history长度: {len(session['chat_history'])}")
             else:
                 self.logger.warning("session对象不存在，无法存储会话历史")
             
-            print("\n=== Session History ===")
-            print(evaluation_result)
+            self.logger.debug("评估结果: %r", evaluation_result)
             return evaluation_result
 
         except Exception as e:
             self.logger.error(f"贷款评估失败: {str(e)}", exc_info=True)
             raise
 
+    @classmethod
+    async def run_batch_evaluation(cls, applications: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """批量评估（离线重新评分等场景），按输入顺序返回每份申请的评估结果
+
+        每份申请使用独立实例，限量并发执行；并发的合规审查由 MicroBatcher 合并为批量模型调用，
+        重复的申请命中专家结果 / 决策缓存。单份申请失败时返回错误字典，不影响其他申请。
+        """
+        semaphore = asyncio.Semaphore(BATCH_EVALUATION_CONCURRENCY)
+
+        async def evaluate_one(collected_data: Dict[str, Any]) -> Dict[str, Any]:
+            async with semaphore:
+                try:
+                    return await cls().phase_evaluation(test_data=collected_data)
+                except Exception as e:
+                    return {
+                        "status": "error",
+                        "message": str(e),
+                        "application_id": collected_data.get("application_id"),
+                        "timestamp": datetime.now().isoformat()
+                    }
+
+        return await asyncio.gather(*(evaluate_one(data) for data in applications))
+
     # 添加测试数据生成功能，方便调试    
     def generate_test_data(self):
         """生成测试数据，方便调试"""
@@ -471,8 +544,31 @@ class LoanApplication:
                 "compliance_analysis": self.compliance_result
             }
             
-            # 调用决策分析
-            result = await self.decision_agent.make_loan_decision(json.dumps(summary, ensure_ascii=False))
+            # 只序列化一次，同时用作缓存键和决策提示词
+            payload = _stable_json(summary)
+            cache_key = _cache_key(payload)
+            cached = _decision_cache.get(cache_key)
+            if cached is not None:
+                self.logger.info("使用缓存的决策结果")
+                print("\n=== Loan Decision ===")
+                print(cached["decision_result"])
+                self.decision_result = cached
+                return cached
+            
+            # 流式调用决策分析，边生成边输出，完整文本作为决策结果
+            parts = []
+            print("\n=== Loan Decision ===")
+            async for text in self.decision_agent.make_loan_decision_stream(payload.decode()):
+                print(text, end="", flush=True)
+                parts.append(text)
+            print()
+            result = {
+                "status": "success",
+                "decision_result": "".join(parts),
+                "timestamp": datetime.now().isoformat()
+            }
+            if _is_cacheable_decision(result):
+                _decision_cache[cache_key] = result
             self.decision_result = result
             return result
             
@@ -509,11 +605,21 @@ class LoanApplication:
                 "compliance_analysis": self.compliance_result
             }
             
+            # 与 run_decision_analysis 共用决策缓存，同一组分析结果只调用一次决策模型
+            payload = _stable_json(summary)
+            cache_key = _cache_key(payload)
+            cached = _decision_cache.get(cache_key)
+            if cached is not None:
+                self.logger.info("使用缓存的决策结果")
+                return cached
+            
             # 调用决策代理
-            result = await self.decision_agent.make_loan_decision(json.dumps(summary, ensure_ascii=False))
+            result = await self.decision_agent.make_loan_decision(payload.decode())
             
             if isinstance(result, dict) and result.get('status') == 'success':
                 self.logger.info("最终决策分析完成")
+                if _is_cacheable_decision(result):
+                    _decision_cache[cache_key] = result
                 return result
             else:
                 error_msg = "最终决策分析失败: 无效的结果格式"
@@ -555,26 +661,11 @@ class LoanApplication:
         self.logger.info("贷款评估流程已完成，结果已显示")
 
     def _configure_logging(self):
-        """配置日志系统"""
-        # 创建日志目录
-        log_dir = "logs"
-        if not os.path.exists(log_dir):
-            os.makedirs(log_dir)
+        """配置日志系统：日志经队列交给共享的监听线程写入文件"""
+        _start_eval_log_listener()
 
-        # 生成日志文件名
-        log_filename = os.path.join(log_dir, f"loan_application_{self.instance_id}.log")
-
-        # 配置文件处理器
-        file_handler = logging.FileHandler(log_filename, encoding='utf-8')
-        file_handler.setLevel(logging.INFO)
-        file_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-        file_handler.setFormatter(file_formatter)
-
-        # 配置logger
-        self.logger = logging.getLogger(f"loan_application_{self.instance_id}")
-        self.logger.setLevel(logging.INFO)
-        self.logger.addHandler(file_handler)
-        self.logger.propagate = False
+        # 共用评估记录器，本实例的日志带上实例 ID
+        self.logger = logging.LoggerAdapter(_eval_logger, {"instance_id": self.instance_id})
 
     async def get_evaluation_data(self) -> Dict[str, Any]:
         """获取评估所需的数据"""
@@ -616,6 +707,7 @@ class LoanApplication:
 
     async def __aenter__(self):
         """异步上下文管理器入口"""
+        await load_secrets()
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
@@ -628,247 +720,11 @@ class LoanApplication:
             if hasattr(self, '_connectors'):
                 for connector in self._connectors:
                     await connector.close()
+            # 关闭共享的 Azure 客户端
+            await close_clients()
         except Exception as e:
             self.logger.error(f"关闭资源时发生错误: {str(e)}")
 
-    def collect_expert_messages(self, messages):
-        """收集专家的消息"""
-        self.logger.info(f"开始收集专家消息，输入消息数量: {len(messages) if messages else 0}")
-        
-        expert_messages = []
-        if not messages:
-            self.logger.warning("输入的消息列表为空")
-            return expert_messages
-            
-        for idx, msg in enumerate(messages):
-            self.logger.info(f"处理第 {idx + 1} 条消息:")
-            self.logger.info(f"  消息类型: {type(msg)}")
-            
-            # 检查消息对象的属性
-            if hasattr(msg, 'name'):
-                self.logger.info(f"  角色: {msg.name}")
-            else:
-                self.logger.warning(f"  消息对象没有name属性: {msg}")
-                continue
-                
-            if hasattr(msg, 'content'):
-                self.logger.info(f"  内容前50个字符: {msg.content[:50]}...")
-            else:
-                self.logger.warning(f"  消息对象没有content属性: {msg}")
-                continue
-            
-            if msg.name in ['CreditExpert', 'FraudExpert', 'ComplianceExpert', 'DecisionAgent'] and msg.name != 'chat_manager':
-                expert_messages.append({
-                    'role': msg.name,
-                    'content': msg.content
-                })
-                self.logger.info(f"  已添加 {msg.name} 的消息")
-            else:
-                self.logger.info(f"  跳过 {msg.name} 的消息")
-        
-        self.logger.info(f"消息收集完成，收集到 {len(expert_messages)} 条消息")
-        return expert_messages
-
-class DecisionAgent(autogen.AssistantAgent):
-    def __init__(self, name, llm_config):
-        super().__init__(
-            name=name,
-            system_message="""你是贷款决策专家，负责:
-1. 执行初始分析
-2. 协调其他专家的评估
-3. 综合所有意见以及提供的决策结果做出最终决策，注意不要被信用分析结果，欺诈分析结果以及合规分析结果影响
-4. 当流程完成时，在消息中包含'EVALUATION_COMPLETE'标记
-
-评估流程：
-1. 第一轮：请各专家分别提供初步评估意见
-2. 第二轮：综合讨论并形成初步决策
-3. 第三轮：发布最终决策并标注'EVALUATION_COMPLETE'
-
-注意事项：
-1. 每轮讨论都要确保所有专家都参与，需要等待所有专家都发表意见后才能进行总结
-2. 引导讨论聚焦于关键风险点
-3. 确保最终决策考虑了所有专家的意见
-4. 只有在完成充分讨论后才能发布最终决策
-发言用英文
-
-EVALUATION_COMPLETE""",
-            llm_config=llm_config
-        )
-
-class CreditExpert(autogen.AssistantAgent):
-    def __init__(self, name, llm_config):
-        super().__init__(
-            name=name,
-            system_message="""你是信用评估专家，负责:
-1. 分析申请人的信用记录
-2. 评估还款能力
-3. 提供详细的信用评分报告
-
-在你的发言中，你需要：
-1. 直接使用提供的信用分析结果，不要被欺诈分析结果，合规分析结果以及决策结果影响
-2. 首轮发言直接展示信用分析结果
-3. 之后发言中结合信用分析结果自由讨论
-
-注意点：
-只负责信用评估相关的内容
-不能代替其他专家发言
-只能就信用相关问题进行讨论
-发言用英文
-""",
-            llm_config=llm_config
-        )
-
-class FraudExpert(autogen.AssistantAgent):
-    def __init__(self, name, llm_config):
-        super().__init__(
-            name=name,
-            system_message="""你是反欺诈专家，负责:
-1. 检查文件真实性
-2. 识别可疑模式
-3. 评估欺诈风险
-
-在你的发言中，你需要：
-1. 直接使用提供的欺诈分析结果，不要被信用分析结果，合规分析结果以及决策结果影响
-2. 首轮发言直接展示欺诈分析结果
-3. 之后发言中结合欺诈分析结果自由讨论
-
-注意点：
-只负责反欺诈相关的内容
-不能代替其他专家发言
-只能就反欺诈相关问题进行讨论
-发言用英文
-
-""",
-            llm_config=llm_config
-        )
-
-class ComplianceExpert(autogen.AssistantAgent):
-    def __init__(self, name, llm_config):
-        super().__init__(
-            name=name,
-            system_message="""你是合规专家，负责:
-1. 确保贷款申请符合监管要求
-2. 审查所有必要文件
-3. 验证合规性
-
-在你的发言中，你需要：
-1. 直接使用提供的合规分析结果，不要被信用分析结果，欺诈分析结果以及决策结果影响
-2. 首轮发言直接展示合规分析结果
-3. 之后发言中结合合规分析结果自由讨论
-
-注意点：
-只负责合规相关的内容
-不能代替其他专家发言
-只能就合规相关问题进行讨论
-发言用英文
-
-评估完成""",
-            llm_config=llm_config
-        )
-
-# 注册函数
-def register_functions(agent):
-    """注册函数到代理"""
-    # 创建LoanApplication实例
-    loan_app = LoanApplication()
-    
-    # 定义函数映射
-    function_map = {
-        "run_initial_analysis": loan_app.run_initial_analysis,
-        "run_credit_analysis": loan_app.run_credit_analysis,
-        "run_fraud_analysis": loan_app.run_fraud_analysis,
-        "run_final_decision": loan_app.run_final_decision
-    }
-    
-    # 注册函数到执行
-    agent.register_for_execution(function_map)
-    
-    # 设置llm_config中的functions
-    agent.llm_config = {
-        "config_list": config_list,
-        "temperature": 0.7,
-        "functions": [
-            {
-                "name": "run_initial_analysis",
-                "description": "执行初始贷款分析",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "loan_data": {
-                            "type": "string",
-                            "description": "贷款申请数据"
-                        }
-                    },
-                    "required": ["loan_data"]
-                }
-            },
-            {
-                "name": "run_credit_analysis",
-                "description": "执行信用分析",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "certificate_file": {
-                            "type": "string",
-                            "description": "工作证明文件"
-                        },
-                        "bank_statement_file": {
-                            "type": "string",
-                            "description": "银行流水文件"
-                        }
-                    },
-                    "required": ["certificate_file", "bank_statement_file"]
-                }
-            },
-            {
-                "name": "run_fraud_analysis",
-                "description": "执行欺诈分析",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "user_id": {
-                            "type": "string",
-                            "description": "用户ID"
-                        }
-                    },
-                    "required": ["user_id"]
-                }
-            },
-            {
-                "name": "run_final_decision",
-                "description": "执行最终决策",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "credit_result": {
-                            "type": "string",
-                            "description": "信用分析结果"
-                        },
-                        "fraud_result": {
-                            "type": "string",
-                            "description": "欺诈分析结果"
-                        },
-                        "compliance_result": {
-                            "type": "string",
-                            "description": "合规分析结果"
-                        },
-                        "decision_result": {
-                            "type": "string",
-                            "description": "决策结果"
-                        }
-                    }
-                }
-            }
-        ]
-    }
-
-def is_expert_message(msg):
-    expert_names = ['CreditExpert', 'FraudExpert', 'ComplianceExpert', 'DecisionAgent']
-    return (
-        hasattr(msg, 'name') and 
-        msg.name in expert_names and
-        msg.name != 'chat_manager'
-    )
 
 async def main():
     """主函数"""
@@ -0,0 +1,57 @@
+"""
+提示词变量序列化
+把字典等结构化数据转为紧凑 JSON 后再填入提示词，避免 str(dict) 的 repr 格式浪费 token。
+"""
+
+from typing import Any, Dict
+
+import orjson
+
+# 与评估无关的用户信息字段（联系方式、记录元数据、重复的 snake_case 字段）
+USER_INFO_EXCLUDED_FIELDS = frozenset({
+    "id", "applicantId", "category", "status", "submissionDate",
+    "phone", "email", "address",
+    "position", "monthly_income", "loan_amount", "loan_purpose",
+    "loan_term", "loan_start_date", "property_size"
+})
+
+# OCR 结果中对模型判断无用的版面 / 置信度字段
+OCR_EXCLUDED_FIELDS = frozenset({
+    "confidence", "boundingBox", "boundingRegions", "bounding_regions",
+    "polygon", "spans", "offset", "length", "pageNumber", "page_number"
+})
+
+
+def to_prompt_text(value: Any) -> str:
+    """将提示词变量序列化为紧凑文本"""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8", errors="ignore")
+    return orjson.dumps(value, default=str).decode()
+
+
+def prune_user_info(user_info: Dict[str, Any]) -> Dict[str, Any]:
+    """去掉 Cosmos 系统字段（_rid、_ts 等）及与评估无关的字段"""
+    return {
+        key: value
+        for key, value in user_info.items()
+        if not key.startswith("_") and key not in USER_INFO_EXCLUDED_FIELDS
+    }
+
+
+def prune_ocr_fields(value: Any) -> Any:
+    """递归去掉 OCR 分析结果中的版面 / 置信度字段和空值"""
+    if isinstance(value, dict):
+        pruned = {}
+        for key, item in value.items():
+            if key in OCR_EXCLUDED_FIELDS:
+                continue
+            item = prune_ocr_fields(item)
+            if item is None or item == "" or item == [] or item == {}:
+                continue
+            pruned[key] = item
+        return pruned
+    if isinstance(value, list):
+        return [prune_ocr_fields(item) for item in value]
+    return value
@@ -0,0 +1,90 @@
+"""
+聊天会话存储
+未配置 REDIS_URL 时使用进程内字典（单 worker 本地开发）；
+配置后会话存入 Redis，多个 uvicorn worker 共享同一份会话，并按 SESSION_TTL 自动过期。
+"""
+
+import os
+import logging
+from typing import Any, Dict, Optional
+
+import orjson
+from pydantic import BaseModel
+from cachetools import TTLCache
+
+logger = logging.getLogger("session_store")
+
+# 会话过期时间（秒），每次写入时刷新
+SESSION_TTL = 3600
+# 进程内存储最多保留的会话数，超出时淘汰最久未写入的会话
+MAX_MEMORY_SESSIONS = 10000
+SESSION_KEY_PREFIX = "sess:"
+
+
+def _to_jsonable(value: Any) -> Any:
+    """orjson 无法直接序列化的对象（如 Pydantic 模型）转换为字典"""
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    return str(value)
+
+
+class MemorySessionStore:
+    """进程内会话存储，返回的字典即存储本身；放弃的会话按 TTL 过期，不会无限增长"""
+
+    def __init__(self):
+        self._sessions: TTLCache = TTLCache(maxsize=MAX_MEMORY_SESSIONS, ttl=SESSION_TTL)
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return self._sessions.get(session_id)
+
+    async def set(self, session_id: str, session: Dict[str, Any]):
+        self._sessions[session_id] = session
+
+    async def close(self):
+        self._sessions.clear()
+
+
+class RedisSessionStore:
+    """Redis 会话存储，会话以 orjson 序列化，修改后需调用 set 写回"""
+
+    def __init__(self, url: str):
+        from redis.asyncio import Redis
+        self.client = Redis.from_url(url)
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        data = await self.client.get(SESSION_KEY_PREFIX + session_id)
+        return orjson.loads(data) if data else None
+
+    async def set(self, session_id: str, session: Dict[str, Any]):
+        await self.client.set(
+            SESSION_KEY_PREFIX + session_id,
+            orjson.dumps(session, default=_to_jsonable),
+            ex=SESSION_TTL
+        )
+
+    async def close(self):
+        await self.client.aclose()
+
+
+_session_store = None
+
+
+def get_session_store():
+    """获取共享的会话存储（配置了 REDIS_URL 时使用 Redis）"""
+    global _session_store
+    if _session_store is None:
+        redis_url = os.getenv("REDIS_URL")
+        if redis_url:
+            logger.info("使用 Redis 会话存储")
+            _session_store = RedisSessionStore(redis_url)
+        else:
+            _session_store = MemorySessionStore()
+    return _session_store
+
+
+async def close_session_store():
+    """关闭会话存储（应用关闭时调用）"""
+    global _session_store
+    if _session_store is not None:
+        await _session_store.close()
+        _session_store = None